@@ -0,0 +1,65 @@
+"""关键词匹配微基准：KeywordIndex 与原先的线性扫描对比
+
+用法（需已安装 astrbot 和 meme_generator）：
+    python benchmarks/bench_keyword_index.py [关键词数量] [消息数量]
+"""
+
+import importlib
+import random
+import sys
+import timeit
+import types
+from pathlib import Path
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+PLUGIN_PACKAGE = "astrbot_plugin_memelite_rs"
+
+
+def load_keyword_index():
+    """按 AstrBot 的方式把插件目录作为包导入"""
+    if PLUGIN_PACKAGE not in sys.modules:
+        package = types.ModuleType(PLUGIN_PACKAGE)
+        package.__path__ = [str(PLUGIN_DIR)]
+        sys.modules[PLUGIN_PACKAGE] = package
+    return importlib.import_module(f"{PLUGIN_PACKAGE}.main").KeywordIndex
+
+
+def linear_fuzzy(keywords: list[str], message: str) -> str | None:
+    return next((k for k in keywords if k in message), None)
+
+
+def linear_exact(keywords: list[str], message: str) -> str | None:
+    first = message.split()[0]
+    return next((k for k in keywords if k == first), None)
+
+
+def main() -> None:
+    keyword_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rng = random.Random(0)
+    chars = [chr(code) for code in range(0x4E00, 0x4E00 + 300)]
+    keywords = sorted({"".join(rng.choices(chars, k=rng.randint(1, 4))) for _ in range(keyword_count)})
+    # 一半消息命中关键词，一半是不含关键词的普通聊天
+    messages = []
+    for i in range(message_count):
+        filler = "".join(rng.choices(chars, k=rng.randint(5, 30)))
+        messages.append(f"{rng.choice(keywords)} {filler}" if i % 2 else filler)
+
+    KeywordIndex = load_keyword_index()
+    build = timeit.timeit(lambda: KeywordIndex(keywords), number=1)
+    index = KeywordIndex(keywords)
+    print(f"关键词 {len(keywords)} 个，消息 {len(messages)} 条，构建索引 {build * 1000:.1f} ms")
+
+    cases = [
+        ("精确-线性扫描", lambda: [linear_exact(keywords, m) for m in messages]),
+        ("精确-KeywordIndex", lambda: [index.match_exact(m) for m in messages]),
+        ("模糊-线性扫描", lambda: [linear_fuzzy(keywords, m) for m in messages]),
+        ("模糊-KeywordIndex", lambda: [index.match_fuzzy(m) for m in messages]),
+    ]
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name}: {seconds / len(messages) * 1e6:.2f} µs/条")
+
+
+if __name__ == "__main__":
+    main()
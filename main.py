@@ -1,22 +1,25 @@
 import asyncio
 import base64
-import random
+import cProfile
+import functools
+import multiprocessing
+import hashlib
+import json
+import os
+import pstats
+import sqlite3
+import threading
 import aiohttp
 import time
+import tracemalloc
 import re
-from collections import OrderedDict
-from meme_generator import (
-    DeserializeError,
-    ImageAssetMissing,
-    ImageDecodeError,
-    ImageEncodeError,
-    ImageNumberMismatch,
-    MemeFeedback,
-    TextNumberMismatch,
-    TextOverLength,
-)
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from meme_generator import Meme, get_memes
-from meme_generator import Image as MemeImage
 from meme_generator.resources import check_resources_in_background
 from meme_generator.tools import MemeProperties, MemeSortBy, render_meme_list
 from astrbot import logger
@@ -26,10 +29,1302 @@ from astrbot.core import AstrBotConfig
 from astrbot.core.platform import AstrMessageEvent
 
 import io
-from typing import List, Union
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, List, Union
 import astrbot.core.message.components as Comp
 from astrbot.core.star.filter.event_message_type import EventMessageType
-from PIL import Image
+from PIL import Image, ImageOps, ImageSequence
+
+from .render_worker import format_meme_error, init_worker, render, render_by_key
+
+
+class KeywordIndex:
+    """meme关键词索引，启动时构建一次
+
+    - 精确匹配：关键词 -> 关键词 的字典，O(1) 查找
+    - 模糊匹配：Aho-Corasick 自动机，单次扫描消息即可找出全部命中的关键词；
+      多个关键词同时命中时取最长的，长度相同取最先出现的
+    """
+
+    def __init__(self, keywords: list[str]):
+        self._exact: dict[str, str] = {}
+        for keyword in keywords:
+            if keyword:
+                self._exact.setdefault(keyword, keyword)
+
+        # 自动机节点：转移表、失配指针、节点处结束的最长关键词
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[str | None] = [None]
+        for keyword in self._exact:
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._goto[node][char] = next_node
+                node = next_node
+            self._output[node] = keyword
+        self._build_fail_links()
+
+    def _build_fail_links(self) -> None:
+        """广度优先构建失配指针，并把失配链上的最长关键词并入当前节点"""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                # 自身就是关键词时自身最长，否则继承失配节点的结果
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self._exact
+
+    def match_exact(self, message_str: str) -> str | None:
+        """精确匹配：消息的第一个单词恰好是关键词"""
+        parts = message_str.split(maxsplit=1)
+        if not parts:
+            return None
+        return self._exact.get(parts[0])
+
+    def match_fuzzy(self, message_str: str) -> str | None:
+        """模糊匹配：消息中包含关键词，返回最长（同长取最靠前）的关键词"""
+        goto, fail, output = self._goto, self._fail, self._output
+        best: str | None = None
+        best_len = 0
+        best_start = 0
+        node = 0
+        for end, char in enumerate(message_str, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            keyword = output[node]
+            if keyword is None:
+                continue
+            length = len(keyword)
+            start = end - length
+            if length > best_len or (length == best_len and start < best_start):
+                best, best_len, best_start = keyword, length, start
+        return best
+
+
+# meme_generator 选项类 -> 参数类型
+OPTION_CLASS_KINDS = {
+    "BooleanOption": "bool",
+    "IntegerOption": "int",
+    "FloatOption": "float",
+    "StringOption": "str",
+}
+
+
+@dataclass(frozen=True)
+class OptionSpec:
+    """预编译的meme选项定义，加载时从 meme.info.params 中一次性提取"""
+
+    name: str | None
+    kind: str | None  # 'bool' / 'int' / 'float' / 'str'，None 表示未知类型
+    default: Any
+    minimum: Any
+    maximum: Any
+    choices: tuple[Any, ...]
+    short: str | None  # 自动生成的短参数
+    short_aliases: tuple[str, ...]  # aliases 中的短参数（不含与 short 重复的）
+
+    @classmethod
+    def from_arg(cls, arg, short: str | None) -> "OptionSpec":
+        name = getattr(arg, 'name', None)
+        default = getattr(arg, 'default', None)
+        minimum = getattr(arg, 'minimum', None)
+        maximum = getattr(arg, 'maximum', None)
+        # meme_generator 的选项没有 type 属性，类型由选项类（BooleanOption 等）区分
+        param_type = getattr(arg, 'type', None) or OPTION_CLASS_KINDS.get(type(arg).__name__)
+
+        # 参数类型：优先使用声明的类型，其次根据默认值推断，最后根据取值范围推断
+        if param_type in ('bool', 'int', 'float', 'str'):
+            kind = param_type
+        elif isinstance(default, bool):
+            kind = 'bool'
+        elif isinstance(default, (int, float)):
+            kind = 'int' if isinstance(default, int) else 'float'
+        elif isinstance(default, str):
+            kind = 'str'
+        elif minimum is not None or maximum is not None:
+            bounds = [bound for bound in (minimum, maximum) if bound is not None]
+            kind = 'int' if all(isinstance(bound, int) for bound in bounds) else 'float'
+        else:
+            kind = None
+
+        choices = getattr(arg, 'choices', None) or getattr(arg, 'options', None) or ()
+        short_aliases = []
+        for alias in getattr(arg, 'aliases', None) or ():
+            clean_alias = alias.lstrip('-')
+            # 短参数，避免与自动生成的短参数重复
+            if len(clean_alias) <= 2 and clean_alias != short:
+                short_aliases.append(clean_alias)
+
+        return cls(
+            name=name,
+            kind=kind,
+            default=default,
+            minimum=minimum,
+            maximum=maximum,
+            choices=tuple(choices),
+            short=short,
+            short_aliases=tuple(short_aliases),
+        )
+
+    def validate(self, value) -> str | None:
+        """检查选项值，不合法时返回错误信息"""
+        if value is None:
+            return None
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if self.kind in ('int', 'float') and not is_number:
+            return f"参数 {self.name} 需要一个数值"
+        if is_number:
+            # 无论声明的类型如何，数值都要检查取值范围
+            if self.minimum is not None and value < self.minimum:
+                return f"参数 {self.name} 不能小于 {self.minimum}"
+            if self.maximum is not None and value > self.maximum:
+                return f"参数 {self.name} 不能大于 {self.maximum}"
+        if self.choices and value not in self.choices:
+            return f"参数 {self.name} 只能是：{'/'.join(str(choice) for choice in self.choices)}"
+        return None
+
+    def describe(self) -> str:
+        """生成meme详情中的参数说明"""
+        arg_line = "• "
+        if self.name:
+            if self.short:
+                arg_line += f"-{self.short}/"
+            if self.short_aliases:
+                arg_line += f"{'/'.join(self.short_aliases)}/"
+            arg_line += f"--{self.name}"
+
+        param_details = []
+        if self.default is not None:
+            param_details.append(f"默认:{self.default}")
+        if self.minimum is not None:
+            param_details.append(f"最小值:{self.minimum}")
+        if self.maximum is not None:
+            param_details.append(f"最大值:{self.maximum}")
+        if self.choices:
+            choices_str = "/".join(str(choice) for choice in self.choices)
+            param_details.append(f"可选:{choices_str}")
+        if param_details:
+            arg_line += f" [{';'.join(param_details)}]"
+        return arg_line
+
+
+@dataclass(frozen=True)
+class MemeEntry:
+    """单个meme的派生数据，加载时从 meme.info 中一次性提取"""
+
+    meme: Meme
+    key: str
+    keywords: tuple[str, ...]
+    tags: frozenset[str]
+    min_images: int
+    max_images: int
+    min_texts: int
+    max_texts: int
+    default_texts: tuple[str, ...]
+    options: tuple[OptionSpec, ...]
+    option_flags: MappingProxyType  # 参数名/短参数/别名 -> OptionSpec
+
+
+class MemeRegistry:
+    """meme注册表：关键词/key -> MemeEntry 的 O(1) 映射"""
+
+    def __init__(self, memes: list[Meme] | None = None):
+        self.memes: list[Meme] = []
+        self.entries: list[MemeEntry] = []
+        self.keywords: list[str] = []
+        self.index = KeywordIndex([])
+        self._lookup: dict[str, MemeEntry] = {}
+        self.rebuild(memes or [])
+
+    def rebuild(self, memes: list[Meme]) -> None:
+        """重新构建注册表（get_memes() 重新加载后调用）"""
+        entries = [self._build_entry(meme) for meme in memes]
+        lookup: dict[str, MemeEntry] = {}
+        for entry in entries:
+            # 与原先的线性查找保持一致：按列表顺序，先出现的meme优先
+            lookup.setdefault(entry.key, entry)
+            for keyword in entry.keywords:
+                lookup.setdefault(keyword, entry)
+        keywords = [keyword for entry in entries for keyword in entry.keywords]
+
+        self.memes = list(memes)
+        self.entries = entries
+        self.keywords = keywords
+        self.index = KeywordIndex(keywords)
+        self._lookup = lookup
+
+    def get(self, keyword: str) -> MemeEntry | None:
+        """根据关键词或meme key获取meme"""
+        return self._lookup.get(keyword)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @staticmethod
+    def _load_args(params) -> tuple[Any, ...]:
+        """获取meme的参数定义"""
+        try:
+            if hasattr(params, 'args') and params.args:
+                return tuple(params.args)
+            elif hasattr(params, 'options') and params.options:
+                return tuple(params.options)
+        except Exception as e:
+            logger.debug(f"无法获取meme参数定义: {e}")
+        return ()
+
+    @classmethod
+    def _build_entry(cls, meme: Meme) -> MemeEntry:
+        info = meme.info
+        params = info.params
+        args = cls._load_args(params)
+
+        # 预编译参数表：参数名/短横线格式/自动短参数/别名 -> OptionSpec
+        specs: list[OptionSpec] = []
+        flags: dict[str, OptionSpec] = {}
+        used_short_params: set[str] = set()
+        for arg in args:
+            name = getattr(arg, 'name', None)
+            # 自动生成短参数：取参数名的首字母作为短参数，避免冲突
+            short = None
+            if name:
+                short_param = name[0].lower()
+                if short_param not in used_short_params:
+                    short = short_param
+                    used_short_params.add(short_param)
+            spec = OptionSpec.from_arg(arg, short)
+            specs.append(spec)
+
+            if name:
+                flags[name] = spec
+                flags[name.replace('_', '-')] = spec  # 支持短横线格式
+                if short:
+                    flags[short] = spec
+            # 别名支持 - 使用meme定义中的aliases
+            for alias in getattr(arg, 'aliases', None) or ():
+                flags[alias] = spec
+
+        return MemeEntry(
+            meme=meme,
+            key=meme.key,
+            keywords=tuple(info.keywords),
+            tags=frozenset(info.tags),
+            min_images=params.min_images,
+            max_images=params.max_images,
+            min_texts=params.min_texts,
+            max_texts=params.max_texts,
+            default_texts=tuple(params.default_texts),
+            options=tuple(specs),
+            option_flags=MappingProxyType(flags),
+        )
+
+
+class AvatarCache:
+    """头像内存缓存：按数量和内存占用双重限制的 LRU
+
+    用户 -> 内容哈希，内容哈希 -> 头像数据（带引用计数），默认头像等相同内容只保存一份。
+    维护去重后总字节数的累计值，插入和淘汰都是 O(1)，并统计命中/未命中/淘汰次数。
+    超过 soft_ttl 的头像仍可使用但需要后台刷新，超过 hard_ttl 的视为未命中（0 表示不过期）
+    """
+
+    def __init__(self, max_count: int, max_bytes: int, soft_ttl: float = 0, hard_ttl: float = 0):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self._data: OrderedDict[str, tuple[bytes, float]] = OrderedDict()  # 用户 -> (内容哈希, 获取时间)
+        self._blobs: dict[bytes, bytes] = {}  # 内容哈希 -> 头像数据
+        self._refs: dict[bytes, int] = {}  # 内容哈希 -> 引用该内容的用户数
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_count > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._data
+
+    @property
+    def unique_count(self) -> int:
+        """去重后实际保存的头像数量"""
+        return len(self._blobs)
+
+    def get(self, user_id: str) -> bytes | None:
+        """从缓存中获取头像，命中时移到末尾（更新访问顺序）"""
+        item = self._data.get(user_id)
+        if item is not None and self.hard_ttl > 0 and time.time() - item[1] > self.hard_ttl:
+            # 超过硬过期时间，丢弃并重新下载
+            self.pop(user_id)
+            self.expirations += 1
+            item = None
+        if item is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return self._blobs[item[0]]
+
+    def is_stale(self, user_id: str) -> bool:
+        """头像是否超过软过期时间，需要后台刷新"""
+        item = self._data.get(user_id)
+        if item is None or self.soft_ttl <= 0:
+            return False
+        return time.time() - item[1] > self.soft_ttl
+
+    def put(self, user_id: str, avatar_data: bytes, fetched_at: float | None = None) -> None:
+        """缓存头像数据，超出数量或内存限制时淘汰最久未使用的"""
+        if not self.enabled:
+            return
+        size = len(avatar_data)
+        self.pop(user_id)
+        # 单个头像就超过内存上限时不缓存，避免清空整个缓存
+        if size > self.max_bytes:
+            return
+        digest = hashlib.blake2b(avatar_data, digest_size=16).digest()
+        while self._data and (
+            len(self._data) >= self.max_count
+            or self.total_bytes + (0 if digest in self._blobs else size) > self.max_bytes
+        ):
+            oldest_key, (oldest_digest, _) = self._data.popitem(last=False)
+            self._release(oldest_digest)
+            self.evictions += 1
+            logger.debug(f"头像缓存已满，删除最旧的头像缓存: {oldest_key}")
+        if digest in self._blobs:
+            self._refs[digest] += 1
+        else:
+            self._blobs[digest] = avatar_data
+            self._refs[digest] = 1
+            self.total_bytes += size
+        self._data[user_id] = (digest, fetched_at or time.time())
+
+    def _release(self, digest: bytes) -> None:
+        """减少内容的引用计数，没有用户引用时释放数据"""
+        self._refs[digest] -= 1
+        if self._refs[digest] <= 0:
+            del self._refs[digest]
+            self.total_bytes -= len(self._blobs.pop(digest))
+
+    def pop(self, user_id: str) -> bool:
+        """删除指定用户的头像缓存，返回是否存在"""
+        item = self._data.pop(user_id, None)
+        if item is None:
+            return False
+        self._release(item[0])
+        return True
+
+    def clear(self) -> int:
+        """清空缓存，返回清理的数量"""
+        count = len(self._data)
+        self._data.clear()
+        self._blobs.clear()
+        self._refs.clear()
+        self.total_bytes = 0
+        return count
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class AvatarDiskCache:
+    """头像磁盘缓存：内容寻址文件 + sqlite 索引，重启后依然有效
+
+    文件按 sha256 存放，相同内容只存一份；索引记录 用户 -> 哈希 以及下载/访问时间，
+    超出容量时按最近访问时间淘汰。所有方法都是同步阻塞的，应通过 asyncio.to_thread 调用
+    """
+
+    def __init__(self, root: Path, max_bytes: int, ttl: float = 0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.root / "index.sqlite3", check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS avatars (
+                user_id TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_avatars_accessed ON avatars (accessed_at);
+            CREATE INDEX IF NOT EXISTS idx_avatars_hash ON avatars (hash);
+            """
+        )
+        self.total_bytes: int = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        with self._lock:
+            if self.ttl > 0:
+                rows = self._db.execute(
+                    "SELECT user_id FROM avatars WHERE fetched_at < ?", (time.time() - self.ttl,)
+                ).fetchall()
+                for (user_id,) in rows:
+                    self._remove_user(user_id)
+            self._evict()
+            self._db.commit()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM avatars").fetchone()[0]
+
+    def get(self, user_id: str) -> tuple[bytes, float] | None:
+        """读取头像，返回 (头像数据, 下载时间)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT hash, fetched_at FROM avatars WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None and self.ttl > 0 and time.time() - row[1] > self.ttl:
+                self._remove_user(user_id)
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            digest, fetched_at = row
+            try:
+                data = self._blob_path(digest).read_bytes()
+            except OSError:
+                # 文件已丢失，清理索引
+                self._remove_user(user_id)
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE avatars SET accessed_at = ? WHERE user_id = ?", (time.time(), user_id)
+            )
+            self._db.commit()
+            self.hits += 1
+            return data, fetched_at
+
+    def put(self, user_id: str, data: bytes, fetched_at: float | None = None) -> None:
+        """写入头像，超出容量时淘汰最久未访问的"""
+        if len(data) > self.max_bytes:
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._remove_user(user_id)
+            if self._db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is None:
+                path = self._blob_path(digest)
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self._db.execute("INSERT INTO blobs (hash, size) VALUES (?, ?)", (digest, len(data)))
+                self.total_bytes += len(data)
+            self._db.execute(
+                "INSERT INTO avatars (user_id, hash, fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (user_id, digest, fetched_at or now, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def pop(self, user_id: str) -> bool:
+        """删除指定用户的头像，返回是否存在"""
+        with self._lock:
+            existed = self._remove_user(user_id)
+            self._db.commit()
+            return existed
+
+    def clear(self) -> int:
+        """清空磁盘缓存，返回清理的数量"""
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM avatars").fetchone()[0]
+            for (digest,) in self._db.execute("SELECT hash FROM blobs").fetchall():
+                self._blob_path(digest).unlink(missing_ok=True)
+            self._db.execute("DELETE FROM avatars")
+            self._db.execute("DELETE FROM blobs")
+            self._db.commit()
+            self.total_bytes = 0
+            return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _remove_user(self, user_id: str) -> bool:
+        """删除索引记录，无人引用的文件一并删除（调用方持有锁）"""
+        row = self._db.execute("SELECT hash FROM avatars WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return False
+        self._db.execute("DELETE FROM avatars WHERE user_id = ?", (user_id,))
+        self._release_blob(row[0])
+        return True
+
+    def _release_blob(self, digest: str) -> None:
+        if self._db.execute("SELECT 1 FROM avatars WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+            return
+        row = self._db.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return
+        self._db.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        self._blob_path(digest).unlink(missing_ok=True)
+        self.total_bytes -= row[0]
+
+    def _evict(self) -> None:
+        """按最近访问时间淘汰，直到不超过容量（调用方持有锁）"""
+        while self.total_bytes > self.max_bytes:
+            row = self._db.execute(
+                "SELECT user_id FROM avatars ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._remove_user(row[0])
+            self.evictions += 1
+
+
+class ByteLRUCache:
+    """按内存占用限制的 LRU 字节缓存，统计命中/未命中/淘汰次数"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        """只检查是否存在，不计入命中统计也不更新访问顺序"""
+        return key in self._data
+
+    def get(self, key: str) -> bytes | None:
+        data = self._data.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        self.pop(key)
+        while self._data and self.total_bytes + len(data) > self.max_bytes:
+            _, oldest = self._data.popitem(last=False)
+            self.total_bytes -= len(oldest)
+            self.evictions += 1
+        self._data[key] = data
+        self.total_bytes += len(data)
+
+    def pop(self, key: str) -> bool:
+        data = self._data.pop(key, None)
+        if data is None:
+            return False
+        self.total_bytes -= len(data)
+        return True
+
+    def clear(self) -> int:
+        count = len(self._data)
+        self._data.clear()
+        self.total_bytes = 0
+        return count
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Deadline:
+    """单次请求的总时间预算，timeout 为 0 表示不限制"""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout if timeout > 0 else None
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    async def wait(self, aw):
+        """在剩余时间内等待，超时抛出 asyncio.TimeoutError 并取消 aw"""
+        return await asyncio.wait_for(aw, self.remaining())
+
+
+# 耗时直方图的桶上界（秒）：0.5ms 起按 1.1 倍递增到约 2 分钟（相对误差不超过 10%），更长的耗时计入溢出桶
+LATENCY_BUCKETS = tuple(0.0005 * 1.1 ** i for i in range(130))
+
+
+class LatencyHistogram:
+    """固定分桶的滚动直方图
+
+    保留当前和上一轮两组桶计数，当前一轮满 window/2 个样本后轮换，
+    分位数由两轮合并后的桶计数得出（桶内线性插值），覆盖最近约 window/2 ~ window 个样本
+    """
+
+    __slots__ = ("_current", "_previous", "_current_count", "_previous_count", "_rotate_at")
+
+    def __init__(self, window: int):
+        self._current = array("I", bytes(4 * (len(LATENCY_BUCKETS) + 1)))
+        self._previous: array | None = None
+        self._current_count = 0
+        self._previous_count = 0
+        self._rotate_at = max(1, window // 2)
+
+    @property
+    def count(self) -> int:
+        """窗口内的样本数"""
+        return self._current_count + self._previous_count
+
+    def record(self, seconds: float) -> None:
+        self._current[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self._current_count += 1
+        if self._current_count >= self._rotate_at:
+            self._previous, self._previous_count = self._current, self._current_count
+            self._current = array("I", bytes(4 * (len(LATENCY_BUCKETS) + 1)))
+            self._current_count = 0
+
+    def percentiles(self, quantiles: tuple[float, ...] = (0.5, 0.95, 0.99)) -> list[float]:
+        """一次累加扫描得出各分位数（quantiles 需升序），在所在桶内按线性插值估算"""
+        total = self.count
+        if not total:
+            return [0.0 for _ in quantiles]
+        current, previous = self._current, self._previous
+        results: list[float] = []
+        cumulative = 0
+        lower = 0.0
+        for index, upper in enumerate(LATENCY_BUCKETS):
+            in_bucket = current[index] + (previous[index] if previous is not None else 0)
+            if in_bucket:
+                while len(results) < len(quantiles) and cumulative + in_bucket >= quantiles[len(results)] * total:
+                    rank = quantiles[len(results)] * total - cumulative
+                    results.append(lower + (upper - lower) * max(rank, 0) / in_bucket)
+                if len(results) == len(quantiles):
+                    return results
+                cumulative += in_bucket
+            lower = upper
+        # 剩余的分位数落在溢出桶中，取最后一个桶的上界
+        results += [LATENCY_BUCKETS[-1]] * (len(quantiles) - len(results))
+        return results
+
+
+class LatencyStats:
+    """各阶段耗时统计：按阶段和按 meme 各维护一个固定分桶的滚动直方图，查询时从桶计数读出分位数
+
+    记录只是一次二分查找和计数加一，每个直方图只占几百字节；另外统计缓存命中等事件次数和按异常类型的错误次数
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._stages: dict[str, LatencyHistogram] = {}
+        self._memes: dict[tuple[str, str], LatencyHistogram] = {}
+        self._totals: Counter[str] = Counter()  # 阶段 -> 累计样本数
+        self._sums: dict[str, float] = {}  # 阶段 -> 累计耗时
+        self.events: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def record(self, stage: str, seconds: float, meme_key: str | None = None) -> None:
+        if not self.enabled:
+            return
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = LatencyHistogram(self.window)
+        histogram.record(seconds)
+        self._totals[stage] += 1
+        self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+        if meme_key is not None:
+            histogram = self._memes.get((meme_key, stage))
+            if histogram is None:
+                histogram = self._memes[(meme_key, stage)] = LatencyHistogram(self.window)
+            histogram.record(seconds)
+
+    @contextmanager
+    def measure(self, stage: str, meme_key: str | None = None):
+        """统计代码块的耗时（抛出异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, meme_key)
+
+    # 以下查询方法可能在线程中执行（写出统计文件），遍历前先复制字典，避免事件循环同时新增键
+
+    def stage_summary(self) -> dict[str, dict]:
+        return {
+            stage: {
+                "count": self._totals[stage],
+                "sum": self._sums[stage],
+                **dict(zip(("p50", "p95", "p99"), histogram.percentiles())),
+            }
+            for stage, histogram in list(self._stages.items())
+        }
+
+    def meme_summary(self) -> dict[str, dict[str, dict]]:
+        result: dict[str, dict[str, dict]] = {}
+        for (meme_key, stage), histogram in list(self._memes.items()):
+            result.setdefault(meme_key, {})[stage] = {
+                "count": histogram.count,
+                **dict(zip(("p50", "p95", "p99"), histogram.percentiles())),
+            }
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "time": time.time(),
+                "stages": self.stage_summary(),
+                "memes": self.meme_summary(),
+                "events": dict(list(self.events.items())),
+                "errors": dict(list(self.errors.items())),
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+
+        def _label(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = ["# TYPE meme_stage_seconds summary"]
+        for stage, summary in self.stage_summary().items():
+            for quantile, name in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(f'meme_stage_seconds{{stage="{_label(stage)}",quantile="{quantile}"}} {summary[name]:.6f}')
+            lines.append(f'meme_stage_seconds_sum{{stage="{_label(stage)}"}} {summary["sum"]:.6f}')
+            lines.append(f'meme_stage_seconds_count{{stage="{_label(stage)}"}} {summary["count"]}')
+        lines.append("# TYPE meme_key_seconds gauge")
+        for meme_key, stages in self.meme_summary().items():
+            for stage, summary in stages.items():
+                for quantile, name in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                    lines.append(
+                        f'meme_key_seconds{{meme="{_label(meme_key)}",stage="{_label(stage)}",quantile="{quantile}"}} {summary[name]:.6f}'
+                    )
+        lines.append("# TYPE meme_events_total counter")
+        for name, count in list(self.events.items()):
+            lines.append(f'meme_events_total{{event="{_label(name)}"}} {count}')
+        lines.append("# TYPE meme_errors_total counter")
+        for name, count in list(self.errors.items()):
+            lines.append(f'meme_errors_total{{type="{_label(name)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        self._stages.clear()
+        self._memes.clear()
+        self._totals.clear()
+        self._sums.clear()
+        self.events.clear()
+        self.errors.clear()
+
+
+class ProfileSession:
+    """单次请求的性能分析：在指定阶段开启 cProfile，并记录阶段前后的 tracemalloc 快照差异"""
+
+    def __init__(self, meme_key: str):
+        self.meme_key = meme_key
+        self.profile = cProfile.Profile()
+        self.started_at = time.perf_counter()
+        self.created = time.time()
+        self.stages: dict[str, float] = {}
+        # 阶段前后的快照，报告时（在线程中）才比较差异
+        self.memory: list[tuple[str, tracemalloc.Snapshot, tracemalloc.Snapshot]] = []
+        self.elapsed = 0.0
+        self.owns_tracemalloc = False
+
+    async def measure(self, stage: str, aw):
+        """分析一个阶段（cProfile 会同时记录这段时间内事件循环上的其他任务）
+
+        tracemalloc 快照在线程中获取，不计入阶段耗时；阶段异常或超时时不记录内存变化
+        """
+        before = await self._take_snapshot()
+        start = time.perf_counter()
+        try:
+            self.profile.enable()
+            profiling = True
+        except ValueError:
+            # 已有其他分析工具在运行
+            profiling = False
+        try:
+            result = await aw
+        finally:
+            if profiling:
+                self.profile.disable()
+            self.stages[stage] = time.perf_counter() - start
+        if before is not None and (after := await self._take_snapshot()) is not None:
+            self.memory.append((stage, before, after))
+        return result
+
+    @staticmethod
+    async def _take_snapshot() -> tracemalloc.Snapshot | None:
+        if not tracemalloc.is_tracing():
+            return None
+        try:
+            return await asyncio.to_thread(tracemalloc.take_snapshot)
+        except RuntimeError:
+            # 获取期间 tracemalloc 已被停止
+            return None
+
+
+class RequestProfiler:
+    """按 1/N 采样或按指定meme分析请求，耗时超过阈值的请求写出报告，按数量轮转
+
+    同一时间只分析一个请求；meme 在渲染线程/进程中合成，cProfile 只能记录事件循环线程，
+    合成本身的耗时见报告中的阶段耗时
+    """
+
+    def __init__(self, root: Path, sample_rate: int, meme_keys: set[str], threshold: float, max_reports: int):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.meme_keys = meme_keys
+        self.threshold = threshold
+        self.max_reports = max_reports
+        self._count = 0
+        self._active: ProfileSession | None = None
+        self.reports = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.meme_keys)
+
+    def begin(self, entry: MemeEntry) -> ProfileSession | None:
+        """判断是否分析本次请求，需要时开始一个分析会话"""
+        if not self.enabled or self._active is not None:
+            return None
+        selected = entry.key in self.meme_keys or not self.meme_keys.isdisjoint(entry.keywords)
+        if not selected and self.sample_rate > 0:
+            self._count += 1
+            selected = self._count % self.sample_rate == 0
+        if not selected:
+            return None
+        session = ProfileSession(entry.key)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            session.owns_tracemalloc = True
+        self._active = session
+        return session
+
+    def finish(self, session: ProfileSession) -> bool:
+        """结束分析会话，返回是否需要写出报告"""
+        session.elapsed = time.perf_counter() - session.started_at
+        if session.owns_tracemalloc:
+            tracemalloc.stop()
+        if self._active is session:
+            self._active = None
+        return session.elapsed >= self.threshold
+
+    def write_report(self, session: ProfileSession) -> Path | None:
+        """生成文本报告并删除超出数量的旧报告（在线程中执行）"""
+        stream = io.StringIO()
+        stream.write(f"meme: {session.meme_key}\n")
+        stream.write(f"时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(session.created))}\n")
+        stream.write(f"总耗时: {session.elapsed * 1000:.1f} ms\n")
+        for stage, seconds in session.stages.items():
+            stream.write(f"  {stage}: {seconds * 1000:.1f} ms\n")
+
+        stream.write("\n===== cProfile（按累计耗时） =====\n")
+        try:
+            pstats.Stats(session.profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+        except TypeError:
+            # 分析期间没有记录到任何调用
+            stream.write("无记录\n")
+
+        # 排除获取快照本身（tracemalloc 和执行它的线程）产生的分配
+        noise = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, threading.__file__))
+        for stage, before, after in session.memory:
+            stream.write(f"\n===== tracemalloc：{stage} 内存变化 =====\n")
+            diffs = after.filter_traces(noise).compare_to(before.filter_traces(noise), "lineno")
+            for diff in diffs[:15]:
+                stream.write(f"{diff}\n")
+
+        name = re.sub(r"[^\w.-]", "_", session.meme_key)
+        path = self.root / f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(session.created))}_{int(session.created * 1000) % 1000:03d}_{name}.txt"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            path.write_text(stream.getvalue(), encoding="utf-8")
+            self.reports += 1
+            if self.max_reports > 0:
+                for old in sorted(self.root.glob("*.txt"))[: -self.max_reports]:
+                    old.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"写入性能分析报告失败: {e}")
+            return None
+        return path
+
+
+class RenderSlot:
+    """RenderExecutor.slot() 分配的名额，with 块退出且登记的任务全部结束后归还"""
+
+    def __init__(self, executor: "RenderExecutor", session_key: str):
+        self._executor = executor
+        self.session_key = session_key
+        self._pending = 0
+        self._closed = False
+
+    def hold(self, future: asyncio.Future) -> None:
+        """登记一个任务，任务结束前不归还名额"""
+        self._pending += 1
+        future.add_done_callback(self._job_done)
+
+    def _job_done(self, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            # 调用方已超时离开时，避免“异常未被获取”的警告
+            future.exception()
+        self._pending -= 1
+        if self._closed and not self._pending:
+            self._executor._release(self.session_key)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if not self._pending:
+            self._executor._release(self.session_key)
+
+
+class RenderBusyError(Exception):
+    """渲染队列已满或会话的并发任务数已达上限"""
+
+
+class RenderExecutor:
+    """meme渲染专用执行器，带准入控制
+
+    - 同时进行（执行中 + 排队中）的任务数不超过 workers + queue_size
+    - 每个会话（群/私聊用户）同时最多占用 per_session 个任务
+    超出限制时 slot() 直接抛出 RenderBusyError，而不是继续排队
+
+    backend 为 "thread" 时在线程池中渲染；为 "process" 时在子进程池中渲染，
+    子进程启动时各自加载一次全部meme，异常退出后自动重建进程池。
+    子进程以 spawn 方式启动，会把主进程的 __main__（AstrBot 的启动脚本）重新导入为 __mp_main__，
+    因此仍会执行其顶层的 import（包括 astrbot），只是不执行 `if __name__ == "__main__"` 中的启动逻辑；
+    渲染本身只用到 render_worker 模块。图片后处理等其他任务始终在线程池中执行
+    """
+
+    def __init__(self, workers: int, queue_size: int, per_session: int, backend: str = "thread"):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.per_session = per_session
+        self.backend = backend if backend in ("thread", "process") else "thread"
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="meme_render")
+        self._process_pool: ProcessPoolExecutor | None = None
+        if self.backend == "process":
+            self._process_pool = self._create_process_pool()
+        self._sessions: dict[str, int] = {}
+        self.active = 0
+        self.rejected = 0
+        self.process_restarts = 0
+        # 渲染任务在本地排队，同时交给线程池/进程池的任务数不超过 workers，
+        # 排队中超时的任务直接取消，已开始执行的任务结束前继续占用并发数；同时统计排队等待时间
+        self._render_semaphore = asyncio.Semaphore(self.workers)
+        self.waiting = 0
+        self.queue_latency = 0.0  # 排队等待时间的指数移动平均（秒）
+        self.stats: LatencyStats | None = None  # 由插件设置，统计排队和合成耗时
+
+    def is_overloaded(self, threshold: float) -> bool:
+        """有任务在排队且平均排队时间超过阈值（秒）时视为过载"""
+        return threshold > 0 and self.waiting > 0 and self.queue_latency > threshold
+
+    def can_admit(self, session_key: str) -> bool:
+        """是否还能接受该会话的新任务"""
+        if self.active >= self.capacity:
+            return False
+        if self.per_session > 0 and self._sessions.get(session_key, 0) >= self.per_session:
+            return False
+        return True
+
+    @contextmanager
+    def slot(self, session_key: str):
+        """占用一个渲染名额；退出 with 块且其中提交的任务全部结束后才释放"""
+        if not self.can_admit(session_key):
+            self.rejected += 1
+            raise RenderBusyError(session_key)
+        self.active += 1
+        self._sessions[session_key] = self._sessions.get(session_key, 0) + 1
+        slot = RenderSlot(self, session_key)
+        try:
+            yield slot
+        finally:
+            slot.close()
+
+    def _release(self, session_key: str) -> None:
+        self.active -= 1
+        remaining = self._sessions[session_key] - 1
+        if remaining:
+            self._sessions[session_key] = remaining
+        else:
+            del self._sessions[session_key]
+
+    async def run(self, func, *args, **kwargs):
+        """在渲染线程池中执行同步函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+
+    async def run_in_slot(self, slot: RenderSlot, func, *args):
+        """在渲染线程池中执行同步函数；调用方被取消时，任务结束前仍占用名额"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, functools.partial(func, *args))
+        slot.hold(future)
+        return await asyncio.shield(future)
+
+    async def render(
+        self,
+        meme: Meme,
+        images: list[tuple[str, bytes]],
+        texts: list[str],
+        options: dict,
+        slot: RenderSlot | None = None,
+    ) -> bytes | str:
+        """渲染meme，成功返回图片数据，失败返回错误信息
+
+        排队时被取消直接放弃；已交给线程/进程执行后被取消（超时）时只停止等待，
+        任务结束前继续占用并发数和 slot 名额，准入计数与实际运行的任务保持一致
+        """
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._render_semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - queued_at
+        self.queue_latency = self.queue_latency * 0.8 + waited * 0.2
+        if self.stats is not None:
+            self.stats.record("排队", waited, meme.key)
+
+        started_at = time.perf_counter()
+        job = asyncio.ensure_future(self._dispatch_render(meme, images, texts, options))
+
+        def _finish(_job: asyncio.Future) -> None:
+            self._render_semaphore.release()
+            if self.stats is not None:
+                self.stats.record("合成", time.perf_counter() - started_at, meme.key)
+            if not _job.cancelled():
+                # 调用方已超时离开时，避免“异常未被获取”的警告
+                _job.exception()
+
+        job.add_done_callback(_finish)
+        if slot is not None:
+            slot.hold(job)
+        return await asyncio.shield(job)
+
+    async def _dispatch_render(
+        self, meme: Meme, images: list[tuple[str, bytes]], texts: list[str], options: dict
+    ) -> bytes | str:
+        if self._process_pool is None:
+            return await self.run(render, meme, images, texts, options)
+
+        pool = self._process_pool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                pool, render_by_key, meme.key, images, texts, options
+            )
+        except BrokenProcessPool:
+            # 同一个坏掉的进程池只重建一次
+            if pool is self._process_pool:
+                logger.error("渲染子进程异常退出，正在重建进程池")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._process_pool = self._create_process_pool()
+                self.process_restarts += 1
+            return "渲染子进程异常退出"
+
+    def _create_process_pool(self) -> ProcessPoolExecutor:
+        # 事件循环所在进程是多线程的，使用 spawn 避免 fork 带来的死锁；
+        # spawn 会在子进程中重新导入主模块，每个子进程的启动时间和内存因此包含 AstrBot 的导入开销
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class RateLimiter:
+    """按 key（用户/群）限流的令牌桶集合，per_minute 为 0 表示不限制"""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        # 按最近使用排序，清理后仍超出数量时淘汰最久未使用的
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def has_token(self, key: str) -> bool:
+        if not self.enabled:
+            return True
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return True
+        bucket.refill()
+        return bucket.tokens >= 1
+
+    def consume(self, key: str) -> None:
+        if not self.enabled:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        else:
+            self._buckets.move_to_end(key)
+        bucket.refill()
+        bucket.tokens -= 1
+
+    def _prune(self) -> None:
+        """清理已经补满（长时间未使用）的令牌桶，仍然超出数量时淘汰最久未使用的"""
+        idle = []
+        for key, bucket in self._buckets.items():
+            bucket.refill()
+            if bucket.tokens >= bucket.burst:
+                idle.append(key)
+        for key in idle:
+            del self._buckets[key]
+        while len(self._buckets) >= self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存，超出数量时淘汰最久未使用的"""
+
+    def __init__(self, max_count: int, ttl: float):
+        self.max_count = max_count
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is not None and self.ttl > 0 and time.monotonic() - item[1] > self.ttl:
+            del self._data[key]
+            item = None
+        if item is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key: str, value) -> None:
+        if self.max_count <= 0:
+            return
+        self._data.pop(key, None)
+        while len(self._data) >= self.max_count:
+            self._data.popitem(last=False)
+        self._data[key] = (value, time.monotonic())
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class SingleFlight:
+    """合并并发请求：同一个 key 同时只执行一次，其余调用者共享同一个结果"""
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, factory):
+        """执行 factory() 并返回结果；已有相同 key 的请求在进行时直接等待它"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield：某个调用者被取消时不影响其他共享结果的调用者
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+
+RENDER_BUSY_MESSAGE = "表情生成繁忙，请稍后再试"
+# 获取不到用户性别时传给生成器的 gender 选项值
+UNKNOWN_GENDER = "unknown"
+REQUEST_TIMEOUT_MESSAGE = "表情生成超时，请稍后再试"
+# 预览图预热任务的执行间隔（秒）
+PREVIEW_WARM_INTERVAL = 600
+# GIF按体积压缩时至少保留的帧数和颜色数
+GIF_MIN_FRAMES = 8
+GIF_MIN_COLORS = 16
+# 下载图片时分块读取的大小
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 部分图床不返回具体的图片类型，这些类型也按图片处理
+DOWNLOAD_GENERIC_TYPES = frozenset({"application/octet-stream", "binary/octet-stream"})
 
 
 @register(
@@ -51,27 +1346,193 @@ class MemePlugin(Star):
         self.admin_users: list[str] = config.get("admin_users", [])
         self.sort_by_str: str = config.get("sort_by_str", "key")
 
-        self.memes: list[Meme] = get_memes()
-        self.meme_keywords = [
-            keyword for meme in self.memes for keyword in meme.info.keywords
-        ]
+        self.registry = MemeRegistry(get_memes())
+
+        # 当前模式下名单的集合快照，只在名单或模式变化时重建
+        self._list_lookup: frozenset[str] = frozenset()
+        # 名单版本号，名单或模式变化时递增，用于meme帮助列表图的缓存
+        self._list_version = 0
+        self._help_cache: tuple[int, bytes, int] | None = None  # (版本号, 列表图, 可用数量)
+        self._help_flight = SingleFlight()
+        # 帮助列表图同一时间只生成一张
+        self._help_render_lock = asyncio.Lock()
+        self.help_list_disk_cache: bool = config.get("help_list_disk_cache", True)
+        self._background_tasks: set[asyncio.Task] = set()
+        self._refresh_availability()
 
         self.prefix: str = config.get("prefix", "")
 
         self.fuzzy_match: int = config.get("fuzzy_match", True)
         self.is_compress_image: bool = config.get("is_compress_image", True)
+        self.compress_max_size: int = config.get("compress_max_size", 512)
+        self.gif_max_size: int = config.get("gif_max_size", 512)
+        self.gif_max_frames: int = config.get("gif_max_frames", 100)
+        self.gif_max_bytes: int = config.get("gif_max_size_kb", 2048) * 1024
+        # 输入图片预处理：合成前把过大的图片缩小、过长的GIF抽帧（0 表示不限制）
+        self.input_max_size: int = config.get("input_max_size", 1024)
+        self.input_max_frames: int = config.get("input_max_frames", 100)
 
         self.is_check_resources: bool = config.get("is_check_resources", True)
         if self.is_check_resources:
             logger.info("正在检查memes资源文件...")
             check_resources_in_background()
 
-        # 头像缓存，使用 OrderedDict 实现 FIFO
-        self._avatar_cache: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
-        self._max_cache_size: int = config.get("avatar_cache_max_count", 50)
-        self._max_cache_size_bytes: int = config.get("avatar_cache_max_size_mb", 20) * 1024 * 1024
-        
-        logger.info(f"头像缓存已初始化，最大缓存数量: {self._max_cache_size}，最大内存占用: {self._max_cache_size_bytes // 1024 // 1024} MB")
+        # 头像内存缓存：按用户 LRU，相同内容的头像只保存一份
+        self._avatar_cache = AvatarCache(
+            max_count=config.get("avatar_cache_max_count", 50),
+            max_bytes=config.get("avatar_cache_max_size_mb", 20) * 1024 * 1024,
+            soft_ttl=config.get("avatar_cache_soft_ttl", 3600),
+            hard_ttl=config.get("avatar_cache_hard_ttl", 86400),
+        )
+        # 正在后台刷新的头像及其任务
+        self._avatar_refresh_tasks: dict[str, asyncio.Task] = {}
+        # 合并同一头像/图片的并发下载
+        self._avatar_flight = SingleFlight()
+        self._image_flight = SingleFlight()
+
+        # 头像磁盘缓存，插件重载或重启后依然有效
+        # 头像磁盘缓存在 initialize 中于线程里打开（建表、清理过期文件），打开完成前视为禁用
+        self._avatar_disk_cache: AvatarDiskCache | None = None
+        self.avatar_disk_cache_enabled: bool = config.get("avatar_disk_cache_enabled", True)
+        self.avatar_disk_cache_max_bytes: int = config.get("avatar_disk_cache_max_size_mb", 50) * 1024 * 1024
+        
+        logger.info(f"头像缓存已初始化，最大缓存数量: {self._avatar_cache.max_count}，最大内存占用: {self._avatar_cache.max_bytes // 1024 // 1024} MB")
+
+        # 共享的 HTTP 会话，首次使用时创建，插件卸载时关闭
+        self._session: aiohttp.ClientSession | None = None
+        self.http_limit_per_host: int = config.get("http_limit_per_host", 8)
+        self.download_force_http: bool = config.get("download_force_http", True)
+        # 用户昵称/性别缓存，减少 get_stranger_info 调用
+        self._user_info_cache = TTLCache(
+            max_count=config.get("user_info_cache_max_count", 500),
+            ttl=config.get("user_info_cache_ttl", 600),
+        )
+        self._user_info_flight = SingleFlight()
+        self.user_info_timeout: float = config.get("user_info_timeout", 3)
+        # meme渲染专用线程池
+        self.render_executor = RenderExecutor(
+            workers=config.get("render_workers", 2),
+            queue_size=config.get("render_queue_size", 8),
+            per_session=config.get("render_max_jobs_per_session", 2),
+            backend=config.get("render_backend", "thread"),
+        )
+        # 各阶段耗时统计（每个阶段保留的最近样本数，0 表示不统计）
+        self._stats = LatencyStats(config.get("stats_window", 1000))
+        if self._stats.enabled:
+            self.render_executor.stats = self._stats
+        # 性能分析：每 N 个请求分析一个，或分析指定meme的全部请求（默认关闭）
+        self._profiler = RequestProfiler(
+            root=self._get_data_dir() / "profiles",
+            sample_rate=config.get("profile_sample_rate", 0),
+            meme_keys=set(config.get("profile_memes", [])),
+            threshold=config.get("profile_latency_threshold", 0),
+            max_reports=config.get("profile_max_reports", 20),
+        )
+        # 定期把统计结果写入文件，留空表示不写入（相对路径相对于插件数据目录）
+        self.metrics_dump_path: str = config.get("metrics_dump_path", "")
+        self.metrics_dump_format: str = config.get("metrics_dump_format", "json")
+        self.metrics_dump_interval: float = config.get("metrics_dump_interval", 60)
+        # 合成结果缓存：相同的meme、图片、文本和选项直接复用上次的结果
+        self._render_cache = ByteLRUCache(config.get("render_cache_max_size_mb", 32) * 1024 * 1024)
+        # 带随机性的meme不缓存（填写meme key或关键词）
+        self.render_cache_exclude: set[str] = set(config.get("render_cache_exclude", []))
+        # meme详情文本和预览图缓存
+        self._detail_text_cache: dict[str, str] = {}
+        self._preview_cache = ByteLRUCache(config.get("preview_cache_max_size_mb", 16) * 1024 * 1024)
+        self._preview_flight = SingleFlight()
+        self.preview_disk_cache: bool = config.get("preview_disk_cache", True)
+        # 定期预生成最常用的前N个meme的预览图，0表示不预生成
+        self.preview_warm_top_n: int = config.get("preview_warm_top_n", 0)
+        # 各meme的触发次数
+        self._meme_usage: Counter[str] = Counter()
+        # 触发限流：每个用户/群每分钟最多触发的次数（令牌桶，默认不限制）
+        self._user_limiter = RateLimiter(
+            config.get("rate_limit_user_per_minute", 0),
+            config.get("rate_limit_user_burst", 3),
+        )
+        self._group_limiter = RateLimiter(
+            config.get("rate_limit_group_per_minute", 0),
+            config.get("rate_limit_group_burst", 10),
+        )
+        # 平均渲染排队时间超过该值（秒）时进入过载模式，拒绝新的触发
+        self.overload_queue_latency: float = config.get("overload_queue_latency", 10)
+        # 被丢弃/拒绝的请求计数
+        self._dropped: Counter[str] = Counter()
+        # 单次请求（收集参数、排队合成、压缩）的总超时
+        self.request_timeout: float = config.get("request_timeout", 60)
+        # 收集参数（下载图片、头像、获取用户信息）的总超时
+        self.param_timeout: float = config.get("param_timeout", 15)
+        # 单张图片下载的大小上限和超时（0 表示不限制）
+        self.download_max_bytes: int = config.get("download_max_size_mb", 10) * 1024 * 1024
+        self.download_timeout: float = config.get("download_timeout", 10)
+
+    async def initialize(self):
+        """插件启动后在后台打开头像磁盘缓存、预生成meme帮助列表图，按需启动预览图预热任务"""
+        if self.avatar_disk_cache_enabled:
+            self._spawn(self._open_avatar_disk_cache())
+        self._spawn(self._get_help_image())
+        if self.preview_warm_top_n > 0:
+            self._spawn(self._warm_previews_loop())
+        if self._stats.enabled and self.metrics_dump_path and self.metrics_dump_interval > 0:
+            self._spawn(self._dump_metrics_loop())
+
+    async def _open_avatar_disk_cache(self) -> None:
+        """在线程中打开头像磁盘缓存，完成后才开始使用"""
+        try:
+            self._avatar_disk_cache = await asyncio.to_thread(
+                AvatarDiskCache,
+                root=self._get_data_dir() / "avatar_cache",
+                max_bytes=self.avatar_disk_cache_max_bytes,
+                ttl=self._avatar_cache.hard_ttl,
+            )
+            logger.info(f"头像磁盘缓存已初始化，最大占用: {self.avatar_disk_cache_max_bytes // 1024 // 1024} MB")
+        except Exception as e:
+            logger.warning(f"头像磁盘缓存初始化失败，将只使用内存缓存: {e}")
+
+    @staticmethod
+    def _get_data_dir() -> Path:
+        """获取插件数据目录"""
+        try:
+            from astrbot.api.star import StarTools
+
+            return Path(StarTools.get_data_dir("astrbot_plugin_memelite_rs"))
+        except Exception:
+            # 旧版本 AstrBot 没有 StarTools，使用默认的插件数据目录
+            data_dir = Path("data") / "plugin_data" / "astrbot_plugin_memelite_rs"
+            data_dir.mkdir(parents=True, exist_ok=True)
+            return data_dir
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """创建后台任务并保留引用"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 HTTP 会话（连接池复用 keep-alive 连接）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=max(self.http_limit_per_host * 4, 32),
+                limit_per_host=self.http_limit_per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def terminate(self):
+        """插件卸载时取消后台任务并关闭共享的 HTTP 会话"""
+        for task in [*self._avatar_refresh_tasks.values(), *self._background_tasks]:
+            task.cancel()
+        self._avatar_refresh_tasks.clear()
+        self._background_tasks.clear()
+        if self._avatar_disk_cache is not None:
+            await asyncio.to_thread(self._avatar_disk_cache.close)
+        self.render_executor.shutdown()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     def _is_admin(self, event: AstrMessageEvent) -> bool:
         """检查用户是否为管理员"""
@@ -93,49 +1554,18 @@ class MemePlugin(Star):
             # 如果无法获取用户ID信息，默认不是管理员
             return False
 
-    def _parse_meme_options(self, meme: Meme, text_parts: list[str]) -> tuple[list[str], dict[str, Union[bool, str, int, float]]]:
+    def _parse_meme_options(self, entry: MemeEntry, text_parts: list[str]) -> tuple[list[str], dict[str, Union[bool, str, int, float]]]:
         """动态解析meme选项参数 - 根据meme的实际参数定义进行解析"""
         options = {}
         remaining_texts = []
-        
-        # 尝试获取meme的参数定义
-        meme_args = []
-        try:
-            if hasattr(meme.info, 'params') and hasattr(meme.info.params, 'args'):
-                meme_args = meme.info.params.args
-            elif hasattr(meme.info, 'params') and hasattr(meme.info.params, 'options'):
-                meme_args = meme.info.params.options
-            
-            if not meme_args:
-                # 如果没有参数定义，使用基本的通用解析
-                return self._parse_basic_options(text_parts)
-                
-        except Exception as e:
-            logger.debug(f"无法获取meme参数定义: {e}")
+
+        if not entry.options:
+            # 如果没有参数定义，使用基本的通用解析
             return self._parse_basic_options(text_parts)
-        
-        # 构建参数映射表
-        param_map = {}
-        used_short_params = set()  # 跟踪已使用的短参数
-        
-        for arg in meme_args:
-            # 主要参数名
-            if hasattr(arg, 'name'):
-                param_map[arg.name] = arg
-                param_map[arg.name.replace('_', '-')] = arg  # 支持短横线格式
-                
-                # 自动生成短参数：取参数名的首字母作为短参数，避免冲突
-                short_param = arg.name[0].lower()
-                if short_param not in used_short_params:
-                    param_map[short_param] = arg
-                    used_short_params.add(short_param)
-            
-            # 别名支持 - 使用meme定义中的aliases
-            if hasattr(arg, 'aliases') and arg.aliases:
-                for alias in arg.aliases:
-                    # 直接使用aliases中定义的别名
-                    param_map[alias] = arg
-        
+
+        # 参数表在加载时已预编译
+        option_flags = entry.option_flags
+
         i = 0
         while i < len(text_parts):
             text = text_parts[i]
@@ -146,11 +1576,11 @@ class MemePlugin(Star):
                 param_name = text.lstrip('-')
                 
                 # 查找匹配的参数定义
-                matched_arg = param_map.get(param_name)
-                if matched_arg:
+                matched_spec = option_flags.get(param_name)
+                if matched_spec:
                     try:
                         consumed, skip_next = self._parse_single_param(
-                            matched_arg, param_name, text_parts, i, options
+                            matched_spec, param_name, text_parts, i, options
                         )
                         if skip_next:
                             i += 1  # 跳过值参数
@@ -177,30 +1607,24 @@ class MemePlugin(Star):
         
         return remaining_texts, options
     
-    def _parse_single_param(self, arg, param_name: str, text_parts: list[str], index: int, options: dict) -> tuple[bool, bool]:
+    def _parse_single_param(self, spec: OptionSpec, param_name: str, text_parts: list[str], index: int, options: dict) -> tuple[bool, bool]:
         """解析单个参数，返回(是否消费, 是否跳过下一个)"""
-        # 获取参数类型和默认值
-        param_type = getattr(arg, 'type', None) if hasattr(arg, 'type') else None
-        default_value = getattr(arg, 'default', None) if hasattr(arg, 'default') else None
-        
         # 获取实际的参数名（用于存储到options中）
-        actual_name = getattr(arg, 'name', param_name) if hasattr(arg, 'name') else param_name
+        actual_name = spec.name or param_name
+        has_value = index + 1 < len(text_parts) and not text_parts[index + 1].startswith('-')
         
         # 根据参数类型解析
-        if param_type == 'bool' or (default_value is not None and isinstance(default_value, bool)):
+        if spec.kind == 'bool':
             # 布尔类型参数
             options[actual_name] = True
             return True, False
         
-        elif param_type in ['int', 'float'] or (default_value is not None and isinstance(default_value, (int, float))):
+        elif spec.kind in ('int', 'float'):
             # 数值类型参数
-            if index + 1 < len(text_parts) and not text_parts[index + 1].startswith('-'):
+            if has_value:
                 try:
                     value = text_parts[index + 1]
-                    if param_type == 'int' or isinstance(default_value, int):
-                        options[actual_name] = int(value)
-                    else:
-                        options[actual_name] = float(value)
+                    options[actual_name] = int(value) if spec.kind == 'int' else float(value)
                     return True, True
                 except ValueError:
                     # 解析失败，当作布尔参数
@@ -211,9 +1635,9 @@ class MemePlugin(Star):
                 options[actual_name] = True
                 return True, False
         
-        elif param_type == 'str' or (default_value is not None and isinstance(default_value, str)):
+        elif spec.kind == 'str':
             # 字符串类型参数
-            if index + 1 < len(text_parts) and not text_parts[index + 1].startswith('-'):
+            if has_value:
                 options[actual_name] = text_parts[index + 1]
                 return True, True
             else:
@@ -223,7 +1647,7 @@ class MemePlugin(Star):
         
         else:
             # 未知类型，尝试智能解析
-            if index + 1 < len(text_parts) and not text_parts[index + 1].startswith('-'):
+            if has_value:
                 value = text_parts[index + 1]
                 # 尝试解析为合适的类型
                 try:
@@ -243,6 +1667,15 @@ class MemePlugin(Star):
                 # 没有值，当作布尔参数
                 options[actual_name] = True
                 return True, False
+
+    @staticmethod
+    def _validate_options(entry: MemeEntry, options: dict) -> str | None:
+        """按预编译的参数表检查选项值（范围、可选值），不合法时返回错误信息"""
+        for name, value in options.items():
+            spec = entry.option_flags.get(name)
+            if spec is not None and spec.name == name and (error := spec.validate(value)):
+                return error
+        return None
     
     def _parse_generic_param(self, param_name: str, text_parts: list[str], index: int, options: dict) -> bool:
         """通用参数解析方法（当无法从meme定义获取参数信息时使用）"""
@@ -289,14 +1722,23 @@ class MemePlugin(Star):
         
         return remaining_texts, options
 
+    def _refresh_availability(self) -> None:
+        """名单或模式变化后重建可用性查找表，并在后台重新生成meme帮助列表图"""
+        current_list, _ = self._get_current_list_info()
+        self._list_lookup = frozenset(current_list)
+        self._list_version += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 尚未进入事件循环（插件初始化时），由 initialize 负责预生成
+            return
+        self._spawn(self._get_help_image())
+
     def _is_meme_available(self, keyword: str) -> bool:
         """判断meme是否可用"""
-        if self.use_whitelist:
-            # 白名单模式：只有在白名单中的才可用
-            return keyword in self.memes_enabled_list
-        else:
-            # 黑名单模式：不在黑名单中的都可用
-            return keyword not in self.memes_disabled_list
+        # 白名单模式：只有在白名单中的才可用
+        # 黑名单模式：不在黑名单中的都可用
+        return (keyword in self._list_lookup) == self.use_whitelist
 
     def _process_meme_operation(self, meme_names: tuple[str], operation: str) -> tuple[list[str], list[str], list[str]]:
         """处理meme启用/禁用操作的通用逻辑
@@ -311,46 +1753,40 @@ class MemePlugin(Star):
         valid_memes = []
         invalid_memes = []
         already_in_state = []
+
+        # 白名单模式下启用、黑名单模式下禁用为加入名单，否则为移出名单
+        current_list, _ = self._get_current_list_info()
+        add_to_list = (operation == 'enable') == self.use_whitelist
+        current_set = set(current_list)
+        removed = set()
         
         for meme_name in meme_names:
-            if meme_name not in self.meme_keywords:
+            if meme_name not in self.registry.index:
                 invalid_memes.append(meme_name)
                 continue
             
-            if operation == 'enable':
-                if self.use_whitelist:
-                    # 白名单模式：添加到白名单
-                    if meme_name in self.memes_enabled_list:
-                        already_in_state.append(meme_name)
-                    else:
-                        self.memes_enabled_list.append(meme_name)
-                        valid_memes.append(meme_name)
+            if add_to_list:
+                if meme_name in current_set:
+                    already_in_state.append(meme_name)
                 else:
-                    # 黑名单模式：从黑名单中移除
-                    if meme_name not in self.memes_disabled_list:
-                        already_in_state.append(meme_name)
-                    else:
-                        self.memes_disabled_list.remove(meme_name)
-                        valid_memes.append(meme_name)
-            
-            elif operation == 'disable':
-                if self.use_whitelist:
-                    # 白名单模式：从白名单中移除
-                    if meme_name not in self.memes_enabled_list:
-                        already_in_state.append(meme_name)
-                    else:
-                        self.memes_enabled_list.remove(meme_name)
-                        valid_memes.append(meme_name)
+                    current_set.add(meme_name)
+                    current_list.append(meme_name)
+                    valid_memes.append(meme_name)
+            else:
+                if meme_name not in current_set:
+                    already_in_state.append(meme_name)
                 else:
-                    # 黑名单模式：添加到黑名单
-                    if meme_name in self.memes_disabled_list:
-                        already_in_state.append(meme_name)
-                    else:
-                        self.memes_disabled_list.append(meme_name)
-                        valid_memes.append(meme_name)
+                    current_set.discard(meme_name)
+                    removed.add(meme_name)
+                    valid_memes.append(meme_name)
+
+        # 一次性移除，避免逐个 list.remove
+        if removed:
+            current_list[:] = [name for name in current_list if name not in removed]
         
         # 如果有变更，保存配置
         if valid_memes:
+            self._refresh_availability()
             self.config.save_config(replace_config=self.config)
         
         return valid_memes, invalid_memes, already_in_state
@@ -448,6 +1884,36 @@ class MemePlugin(Star):
     @filter.command("meme帮助", alias={"表情帮助"})
     async def memes_help(self, event: AstrMessageEvent):
         "查看有哪些关键词可以触发meme"
+        output, available_count = await self._get_help_image()
+        if output:
+            mode = "白名单" if self.use_whitelist else "黑名单"
+            total_count = len(self.registry)
+            yield event.chain_result([
+                Comp.Plain(f"当前模式：{mode} | 可用meme：{available_count}/{total_count}\n"),
+                Comp.Image.fromBytes(output)
+            ])
+        else:
+            yield event.plain_result("meme列表图生成失败")
+
+    async def _get_help_image(self) -> tuple[bytes | None, int]:
+        """获取meme帮助列表图，名单版本未变化时直接使用缓存"""
+        version = self._list_version
+        if self._help_cache and self._help_cache[0] == version:
+            return self._help_cache[1], self._help_cache[2]
+        return await self._help_flight.do(str(version), lambda: self._render_help_image(version))
+
+    async def _render_help_image(self, version: int) -> tuple[bytes | None, int]:
+        """串行生成帮助列表图：排队期间名单又发生变化时放弃旧版本，直接使用最新版本的结果
+
+        连续多次修改名单时，最多只有正在生成的一张和最新版本的一张，不会同时生成多张
+        """
+        async with self._help_render_lock:
+            if version == self._list_version:
+                return await self._build_help_image(version)
+        return await self._get_help_image()
+
+    async def _build_help_image(self, version: int) -> tuple[bytes | None, int]:
+        """生成meme帮助列表图（优先读取磁盘缓存）"""
         sort_by_map = {
         "key": MemeSortBy.Key,
         "keywords": MemeSortBy.Keywords,
@@ -461,39 +1927,90 @@ class MemePlugin(Star):
         available_memes = []
         exclude_memes = []
         
-        for meme in self.memes:
+        for entry in self.registry:
             # 检查meme的任意一个关键词是否可用
-            meme_available = any(self._is_meme_available(keyword) for keyword in meme.info.keywords)
+            meme_available = any(self._is_meme_available(keyword) for keyword in entry.keywords)
             if meme_available:
-                available_memes.append(meme)
+                available_memes.append(entry)
             else:
-                exclude_memes.append(meme.key)
+                exclude_memes.append(entry.key)
 
         meme_properties: dict[str, MemeProperties] = {}
-        for meme in available_memes:
+        for entry in available_memes:
             properties = MemeProperties(disabled=False, hot=False, new=False)
-            meme_properties[meme.key] = properties
-
-        # 使用 asyncio.to_thread 来运行同步函数
-        output: bytes | None = await asyncio.to_thread(
-            render_meme_list,  # type: ignore
-            meme_properties=meme_properties,
-            exclude_memes=exclude_memes,
-            sort_by=sort_by,
-            sort_reverse=False,
-            text_template="{index}. {keywords}",
-            add_category_icon=True,
-        )
-        if output:
-            mode = "白名单" if self.use_whitelist else "黑名单"
-            total_count = len(self.memes)
-            available_count = len(available_memes)
-            yield event.chain_result([
-                Comp.Plain(f"当前模式：{mode} | 可用meme：{available_count}/{total_count}\n"),
-                Comp.Image.fromBytes(output)
-            ])
-        else:
-            yield event.plain_result("meme列表图生成失败")
+            meme_properties[entry.key] = properties
+
+        # 磁盘缓存按列表内容命名，重启后依然有效
+        cache_path = None
+        if self.help_list_disk_cache:
+            state = json.dumps(
+                [self.sort_by_str, sorted(entry.key for entry in available_memes), sorted(exclude_memes)],
+                ensure_ascii=False,
+            )
+            digest = hashlib.sha256(state.encode()).hexdigest()[:16]
+            cache_path = self._get_data_dir() / "help_list" / f"meme_list_{digest}.png"
+
+        output: bytes | None = None
+        if cache_path is not None:
+            output = await asyncio.to_thread(self._read_file, cache_path)
+            if output:
+                await asyncio.to_thread(self._prune_help_files, cache_path)
+
+        if not output:
+            # 使用 asyncio.to_thread 来运行同步函数
+            output = await asyncio.to_thread(
+                render_meme_list,  # type: ignore
+                meme_properties=meme_properties,
+                exclude_memes=exclude_memes,
+                sort_by=sort_by,
+                sort_reverse=False,
+                text_template="{index}. {keywords}",
+                add_category_icon=True,
+            )
+            if output and cache_path is not None:
+                await asyncio.to_thread(self._replace_help_file, cache_path, output)
+
+        available_count = len(available_memes)
+        # 生成期间名单又发生变化时不写入缓存
+        if output and version == self._list_version:
+            self._help_cache = (version, output, available_count)
+        return output, available_count
+
+    @staticmethod
+    def _read_file(path: Path) -> bytes | None:
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes) -> bool:
+        """原子写入文件，失败时只记录日志，返回是否写入成功"""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"写入缓存文件失败: {e}")
+            return False
+
+    @classmethod
+    def _replace_help_file(cls, path: Path, data: bytes) -> None:
+        """写入新的帮助列表图，成功后删除旧名单状态对应的列表图"""
+        if cls._write_file(path, data):
+            cls._prune_help_files(path)
+
+    @staticmethod
+    def _prune_help_files(keep: Path) -> None:
+        """只保留当前名单状态的帮助列表图"""
+        for old_path in keep.parent.glob("meme_list_*.png"):
+            if old_path != keep:
+                try:
+                    old_path.unlink()
+                except OSError as e:
+                    logger.warning(f"删除旧的帮助列表图失败: {e}")
 
 
     @filter.command("meme详情", alias={"表情详情"})
@@ -505,7 +2022,7 @@ class MemePlugin(Star):
             yield event.plain_result("未指定要查看的meme")
             return
         keyword = str(keyword)
-        target_keyword = next((k for k in self.meme_keywords if k == keyword), None)
+        target_keyword = keyword if keyword in self.registry.index else None
         if target_keyword is None:
             yield event.plain_result("未支持的meme关键词")
             return
@@ -517,22 +2034,32 @@ class MemePlugin(Star):
             return
 
         # 匹配meme
-        meme = self._find_meme(keyword)
-        if not meme:
+        entry = self.registry.get(keyword)
+        if not entry:
             yield event.plain_result("未找到相关meme")
             return
 
+        meme_info = self._get_meme_detail_text(entry)
+        preview = await self._get_preview(entry)
+        chain: list = [Comp.Plain(meme_info)]
+        if preview:
+            chain.append(Comp.Image.fromBytes(preview))
+        yield event.chain_result(chain)
+
+    def _get_meme_detail_text(self, entry: MemeEntry) -> str:
+        """生成meme详情文本，结果按meme缓存"""
+        if cached := self._detail_text_cache.get(entry.key):
+            return cached
+
         # 提取meme的所有参数
-        name = meme.key
-        info = meme.info
-        params = info.params
-        keywords = info.keywords
-        min_images = params.min_images
-        max_images = params.max_images
-        min_texts = params.min_texts
-        max_texts = params.max_texts
-        default_texts = params.default_texts
-        tags = info.tags
+        name = entry.key
+        keywords = list(entry.keywords)
+        min_images = entry.min_images
+        max_images = entry.max_images
+        min_texts = entry.min_texts
+        max_texts = entry.max_texts
+        default_texts = list(entry.default_texts)
+        tags = entry.tags
 
         meme_info = ""
         if name:
@@ -562,90 +2089,74 @@ class MemePlugin(Star):
             meme_info += f"标签：{list(tags)}\n"
 
         # 添加参数选项信息
-        meme_args = []
-        try:
-            if hasattr(info.params, 'args') and info.params.args:
-                meme_args = info.params.args
-            elif hasattr(info.params, 'options') and info.params.options:
-                meme_args = info.params.options
-        except:
-            pass
-        
-        if meme_args:
-            meme_info += f"\n可用参数 ({len(meme_args)}个)：\n"
-            
-            # 先构建短参数映射以检查冲突
-            used_short_params = set()
-            short_param_map = {}
-            for arg in meme_args:
-                if hasattr(arg, 'name'):
-                    short_param = arg.name[0].lower()
-                    if short_param not in used_short_params:
-                        short_param_map[arg.name] = short_param
-                        used_short_params.add(short_param)
-            
-            for i, arg in enumerate(meme_args):
-                arg_line = f"• "
-                
-                # 参数名和别名
-                if hasattr(arg, 'name'):
-                    # 显示自动生成的短参数（如果没有冲突）
-                    if arg.name in short_param_map:
-                        arg_line += f"-{short_param_map[arg.name]}/"
-                    
-                    # 添加aliases中的短参数
-                    if hasattr(arg, 'aliases') and arg.aliases:
-                        short_aliases = []
-                        for alias in arg.aliases:
-                            clean_alias = alias.lstrip('-')
-                            if len(clean_alias) <= 2:  # 短参数
-                                # 避免与自动生成的短参数重复
-                                if arg.name not in short_param_map or clean_alias != short_param_map[arg.name]:
-                                    short_aliases.append(clean_alias)
-                        if short_aliases:
-                            arg_line += f"{'/'.join(short_aliases)}/"
-                    
-                    arg_line += f"--{arg.name}"
-                
-                # 参数详细信息
-                param_details = []
-                
-                # 默认值
-                if hasattr(arg, 'default') and arg.default is not None:
-                    param_details.append(f"默认:{arg.default}")
-                
-                # 最小值和最大值
-                if hasattr(arg, 'minimum') and arg.minimum is not None:
-                    param_details.append(f"最小值:{arg.minimum}")
-                if hasattr(arg, 'maximum') and arg.maximum is not None:
-                    param_details.append(f"最大值:{arg.maximum}")
-                
-                # 可选值
-                if hasattr(arg, 'choices') and arg.choices:
-                    choices_str = "/".join(str(choice) for choice in arg.choices)
-                    param_details.append(f"可选:{choices_str}")
-                elif hasattr(arg, 'options') and arg.options:
-                    choices_str = "/".join(str(option) for option in arg.options)
-                    param_details.append(f"可选:{choices_str}")
-                
-                if param_details:
-                    arg_line += f" [{';'.join(param_details)}]"
-                
-                meme_info += arg_line + "\n"
-                
-                # 限制显示数量避免信息过长
-                if i >= 4:  # 只显示前5个参数
-                    remaining = len(meme_args) - 5
-                    if remaining > 0:
-                        meme_info += f"  ... 还有 {remaining} 个参数\n"
-                    break
-
-        preview: bytes = meme.generate_preview()  # type: ignore
-        chain = [
-            Comp.Plain(meme_info),
-            Comp.Image.fromBytes(preview),
-        ]
-        yield event.chain_result(chain)
+        meme_options = entry.options
+        if meme_options:
+            meme_info += f"\n可用参数 ({len(meme_options)}个)：\n"
+            for spec in meme_options[:5]:
+                meme_info += spec.describe() + "\n"
+            # 限制显示数量避免信息过长，只显示前5个参数
+            remaining = len(meme_options) - 5
+            if remaining > 0:
+                meme_info += f"  ... 还有 {remaining} 个参数\n"
+
+        self._detail_text_cache[entry.key] = meme_info
+        return meme_info
+
+    def _preview_path(self, entry: MemeEntry) -> Path:
+        """预览图的磁盘缓存路径，meme更新后（修改时间变化）自动换用新文件"""
+        version = hashlib.sha256(str(getattr(entry.meme.info, "date_modified", "")).encode()).hexdigest()[:8]
+        return self._get_data_dir() / "previews" / f"{entry.key}_{version}"
+
+    async def _get_preview(self, entry: MemeEntry) -> bytes | None:
+        """获取meme预览图：内存缓存 -> 磁盘缓存 -> 在渲染线程池中生成"""
+        if preview := self._preview_cache.get(entry.key):
+            return preview
+        return await self._preview_flight.do(entry.key, lambda: self._load_preview(entry))
+
+    async def _load_preview(self, entry: MemeEntry) -> bytes | None:
+        cache_path = self._preview_path(entry) if self.preview_disk_cache else None
+        preview = None
+        if cache_path is not None:
+            preview = await asyncio.to_thread(self._read_file, cache_path)
+        if not preview:
+            result = await self.render_executor.run(entry.meme.generate_preview)
+            if not isinstance(result, bytes):
+                logger.error(f"生成预览图失败：{format_meme_error(result)}")
+                return None
+            preview = result
+            if cache_path is not None:
+                await asyncio.to_thread(self._write_file, cache_path, preview)
+        self._preview_cache.put(entry.key, preview)
+        return preview
+
+    async def _warm_previews_loop(self) -> None:
+        """定期预生成最常用meme的预览图"""
+        while True:
+            await asyncio.sleep(PREVIEW_WARM_INTERVAL)
+            for key, _ in self._meme_usage.most_common(self.preview_warm_top_n):
+                entry = self.registry.get(key)
+                if entry and key not in self._preview_cache:
+                    try:
+                        await self._get_preview(entry)
+                    except Exception as e:
+                        logger.debug(f"预生成预览图失败: {key}: {e}")
+
+    async def _dump_metrics_loop(self) -> None:
+        """定期把耗时统计写入文件"""
+        path = Path(self.metrics_dump_path)
+        if not path.is_absolute():
+            path = self._get_data_dir() / path
+        while True:
+            await asyncio.sleep(self.metrics_dump_interval)
+            await asyncio.to_thread(self._dump_metrics, path)
+
+    def _dump_metrics(self, path: Path) -> None:
+        """生成统计文本并写入文件（在线程中执行，不阻塞事件循环）"""
+        if self.metrics_dump_format == "prometheus":
+            content = self._stats.to_prometheus()
+        else:
+            content = self._stats.to_json()
+        self._write_file(path, content.encode())
 
     @filter.command("禁用meme", alias={"添加到黑名单"})
     async def add_to_blacklist(
@@ -707,6 +2218,7 @@ class MemePlugin(Star):
         self.use_whitelist = not self.use_whitelist
         self.config.set("use_whitelist", self.use_whitelist)
         self.config.save_config(replace_config=self.config)
+        self._refresh_availability()
         
         mode = "白名单" if self.use_whitelist else "黑名单"
         yield event.plain_result(f"已切换到 {mode} 模式")
@@ -723,6 +2235,7 @@ class MemePlugin(Star):
         count = len(current_list)
         current_list.clear()
         self.config.save_config(replace_config=self.config)
+        self._refresh_availability()
         yield event.plain_result(f"已清空{mode}，共清理了 {count} 个meme")
         logger.info(f"{mode}已清空")
 
@@ -741,11 +2254,11 @@ class MemePlugin(Star):
         
         # 找到包含指定标签的所有meme
         tagged_memes = []
-        for meme in self.memes:
-            if tag in meme.info.tags:
+        for entry in self.registry:
+            if tag in entry.tags:
                 # 获取第一个关键词作为代表
-                if meme.info.keywords:
-                    tagged_memes.append(meme.info.keywords[0])
+                if entry.keywords:
+                    tagged_memes.append(entry.keywords[0])
         
         if not tagged_memes:
             yield event.plain_result(f"没有找到标签为 '{tag}' 的meme")
@@ -788,19 +2301,22 @@ class MemePlugin(Star):
         valid_memes = []
         invalid_memes = []
         already_exists = []
+        current_set = set(current_list)
         
         for meme_name in import_names:
-            if meme_name not in self.meme_keywords:
+            if meme_name not in self.registry.index:
                 invalid_memes.append(meme_name)
                 continue
             
-            if meme_name in current_list:
+            if meme_name in current_set:
                 already_exists.append(meme_name)
             else:
+                current_set.add(meme_name)
                 current_list.append(meme_name)
                 valid_memes.append(meme_name)
         
         if valid_memes:
+            self._refresh_availability()
             self.config.save_config(replace_config=self.config)
         
         result_msg = f"导入{mode}结果：\n"
@@ -947,8 +2463,10 @@ class MemePlugin(Star):
     @filter.command("清空头像缓存", alias={"清理头像缓存"})
     async def clear_avatar_cache(self, event: AstrMessageEvent):
         """清空头像缓存"""
-        cache_count = len(self._avatar_cache)
-        self._avatar_cache.clear()
+        cache_count = self._avatar_cache.clear()
+        if self._avatar_disk_cache is not None:
+            disk_count = await asyncio.to_thread(self._avatar_disk_cache.clear)
+            cache_count = max(cache_count, disk_count)
         yield event.plain_result(f"已清空头像缓存，共清理了 {cache_count} 个头像")
         logger.info(f"头像缓存已清空，共清理了 {cache_count} 个头像")
 
@@ -961,8 +2479,10 @@ class MemePlugin(Star):
             yield event.plain_result(f"{error_msg}，例如：删除头像缓存 @用户 或 删除头像缓存 123456789")
             return
         
-        if target_user_id in self._avatar_cache:
-            del self._avatar_cache[target_user_id]
+        removed = self._avatar_cache.pop(target_user_id)
+        if self._avatar_disk_cache is not None:
+            removed = await asyncio.to_thread(self._avatar_disk_cache.pop, target_user_id) or removed
+        if removed:
             yield event.plain_result(f"已删除用户 {target_user_id} 的头像缓存")
             logger.info(f"已删除用户 {target_user_id} 的头像缓存，当前缓存数量: {len(self._avatar_cache)}")
         else:
@@ -971,30 +2491,115 @@ class MemePlugin(Star):
     @filter.command("查看头像缓存", alias={"头像缓存状态"})
     async def show_avatar_cache_status(self, event: AstrMessageEvent):
         """查看头像缓存状态"""
-        cache_count = len(self._avatar_cache)
-        max_count = self._max_cache_size
-        max_size_mb = self._max_cache_size_bytes // 1024 // 1024
+        cache = self._avatar_cache
+        cache_count = len(cache)
+        max_count = cache.max_count
+        max_size_mb = cache.max_bytes // 1024 // 1024
         
-        if self._max_cache_size <= 0:
+        if not cache.enabled:
             yield event.plain_result("头像缓存已禁用")
             return
         
+        stats_info = f"命中: {cache.hits}，未命中: {cache.misses}，命中率: {cache.hit_rate*100:.1f}%，淘汰: {cache.evictions}，过期: {cache.expirations}"
+        disk_cache = self._avatar_disk_cache
+        if disk_cache is not None:
+            disk_count = await asyncio.to_thread(len, disk_cache)
+            stats_info += (
+                f"\n磁盘缓存: {disk_count} 个，占用 {disk_cache.total_bytes / 1024 / 1024:.2f}/{disk_cache.max_bytes // 1024 // 1024} MB，"
+                f"命中: {disk_cache.hits}，未命中: {disk_cache.misses}，淘汰: {disk_cache.evictions}"
+            )
         if cache_count == 0:
-            yield event.plain_result(f"头像缓存为空\n最大数量限制: {max_count}\n最大内存限制: {max_size_mb} MB")
+            yield event.plain_result(f"头像缓存为空\n最大数量限制: {max_count}\n最大内存限制: {max_size_mb} MB\n{stats_info}")
         else:
-            # 计算缓存中每个头像的大小
-            total_size = self._get_cache_size_bytes()
+            # 缓存总大小由缓存实时累计，无需重新统计
+            total_size = cache.total_bytes
             size_mb = total_size / 1024 / 1024
             avg_size_kb = total_size / cache_count / 1024
             
             cache_info = f"头像缓存状态:\n"
             cache_info += f"缓存数量: {cache_count}/{max_count}\n"
+            cache_info += f"去重后头像数: {cache.unique_count}\n"
             cache_info += f"内存占用: {size_mb:.2f}/{max_size_mb} MB\n"
             cache_info += f"平均大小: {avg_size_kb:.1f} KB/个\n"
-            cache_info += f"使用率: 数量 {cache_count/max_count*100:.1f}%，内存 {size_mb/max_size_mb*100:.1f}%"
+            cache_info += f"使用率: 数量 {cache_count/max_count*100:.1f}%，内存 {size_mb/max(max_size_mb, 1)*100:.1f}%\n"
+            cache_info += stats_info
             
             yield event.plain_result(cache_info)
 
+    @filter.command("查看渲染缓存", alias={"渲染缓存状态"})
+    async def show_render_cache_status(self, event: AstrMessageEvent):
+        """查看合成结果缓存状态"""
+        cache = self._render_cache
+        if not cache.enabled:
+            yield event.plain_result("合成结果缓存已禁用")
+            return
+        cache_info = f"合成结果缓存状态:\n"
+        cache_info += f"缓存数量: {len(cache)}\n"
+        cache_info += f"内存占用: {cache.total_bytes / 1024 / 1024:.2f}/{cache.max_bytes // 1024 // 1024} MB\n"
+        cache_info += f"命中: {cache.hits}，未命中: {cache.misses}，命中率: {cache.hit_rate*100:.1f}%，淘汰: {cache.evictions}"
+        yield event.plain_result(cache_info)
+
+    @filter.command("meme性能", alias={"表情性能"})
+    async def show_performance_stats(self, event: AstrMessageEvent, meme_name: str = ""):
+        """查看各阶段耗时分位数，指定meme时只显示该meme"""
+        if not self._is_admin(event):
+            yield event.plain_result("❌ 此命令需要管理员权限")
+            return
+        stats = self._stats
+        if not stats.enabled:
+            yield event.plain_result("耗时统计已禁用")
+            return
+
+        def _fmt(summary: dict) -> str:
+            return (
+                f"p50 {summary['p50'] * 1000:.0f}ms / p95 {summary['p95'] * 1000:.0f}ms / "
+                f"p99 {summary['p99'] * 1000:.0f}ms（{summary['count']}次）"
+            )
+
+        if meme_name:
+            entry = self.registry.get(meme_name)
+            memes = stats.meme_summary()
+            if entry is None or entry.key not in memes:
+                yield event.plain_result(f"没有 {meme_name} 的耗时记录")
+                return
+            lines = [f"{entry.key} 各阶段耗时（最近约{stats.window}次）:"]
+            lines += [f"{stage}: {_fmt(summary)}" for stage, summary in memes[entry.key].items()]
+            yield event.plain_result("\n".join(lines))
+            return
+
+        stages = stats.stage_summary()
+        if not stages:
+            yield event.plain_result("暂无耗时记录")
+            return
+        lines = [f"各阶段耗时（最近约{stats.window}次）:"]
+        lines += [f"{stage}: {_fmt(summary)}" for stage, summary in stages.items()]
+        totals = {key: item["总计"] for key, item in stats.meme_summary().items() if "总计" in item}
+        if totals:
+            lines.append("最慢的meme（按p95）:")
+            for key, summary in sorted(totals.items(), key=lambda kv: kv[1]["p95"], reverse=True)[:5]:
+                lines.append(f"{key}: {_fmt(summary)}")
+        if stats.events:
+            lines.append("事件: " + "，".join(f"{name} {count}" for name, count in stats.events.items()))
+        if stats.errors:
+            lines.append("错误: " + "，".join(f"{name} {count}" for name, count in stats.errors.most_common()))
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("meme负载状态")
+    async def show_load_status(self, event: AstrMessageEvent):
+        """查看渲染负载和被丢弃的请求数"""
+        executor = self.render_executor
+        status_msg = f"渲染方式: {executor.backend}，线程/进程数: {executor.workers}\n"
+        status_msg += f"进行中的任务: {executor.active}/{executor.capacity}，排队中: {executor.waiting}\n"
+        status_msg += f"平均排队时间: {executor.queue_latency:.2f} 秒"
+        if executor.is_overloaded(self.overload_queue_latency):
+            status_msg += "（过载）"
+        status_msg += "\n被丢弃的请求: "
+        if self._dropped:
+            status_msg += "，".join(f"{reason} {count}" for reason, count in self._dropped.items())
+        else:
+            status_msg += "无"
+        yield event.plain_result(status_msg)
+
     @filter.event_message_type(EventMessageType.ALL)
     async def meme_handle(self, event: AstrMessageEvent):
         """
@@ -1034,59 +2639,196 @@ class MemePlugin(Star):
         if not message_str:
             return
 
+        match_start = time.perf_counter()
         if self.fuzzy_match:
             # 模糊匹配：检查关键词是否在消息字符串中
-            keyword = next((k for k in self.meme_keywords if k in message_str), None)
+            keyword = self.registry.index.match_fuzzy(message_str)
         else:
             # 精确匹配：检查关键词是否等于消息字符串的第一个单词
-            keyword = next(
-                (k for k in self.meme_keywords if k == message_str.split()[0]), None
-            )
+            keyword = self.registry.index.match_exact(message_str)
+        self._stats.record("匹配", time.perf_counter() - match_start)
 
         if not keyword or not self._is_meme_available(keyword):
             return
 
         # 匹配meme
-        meme = self._find_meme(keyword)
-        if not meme:
+        entry = self.registry.get(keyword)
+        if not entry:
             yield event.plain_result("未找到相关meme")
             return
 
-        # 收集参数
-        meme_images, texts, options = await self._get_parms(event, keyword, meme)
+        # 触发频率超限时静默丢弃，避免回复刷屏
+        user_key = str(event.get_sender_id())
+        group_key = str(event.get_group_id() or "")
+        if not self._user_limiter.has_token(user_key):
+            self._dropped["用户限流"] += 1
+            logger.debug(f"用户 {user_key} 触发过于频繁，忽略本次请求")
+            return
+        if group_key and not self._group_limiter.has_token(group_key):
+            self._dropped["群限流"] += 1
+            logger.debug(f"群 {group_key} 触发过于频繁，忽略本次请求")
+            return
+        self._user_limiter.consume(user_key)
+        if group_key:
+            self._group_limiter.consume(group_key)
+
+        # 过载时直接拒绝，避免积压
+        if self.render_executor.is_overloaded(self.overload_queue_latency):
+            self._dropped["过载"] += 1
+            yield event.plain_result(RENDER_BUSY_MESSAGE)
+            return
+
+        # 渲染队列已满时直接拒绝，不再收集参数
+        session_key = self._get_session_key(event)
+        if not self.render_executor.can_admit(session_key):
+            self.render_executor.rejected += 1
+            self._dropped["队列已满"] += 1
+            yield event.plain_result(RENDER_BUSY_MESSAGE)
+            return
 
-        # 合成表情
-        image: bytes = await self._meme_generate(meme, meme_images, texts, options)
+        # 只统计被接受的请求，限流或拒绝的刷屏请求不影响预热排序
+        self._meme_usage[entry.key] += 1
+
+        # 整个请求（收集参数、排队合成、压缩）共享同一个时间预算
+        deadline = Deadline(self.request_timeout)
+        request_start = time.perf_counter()
+        profile = self._profiler.begin(entry)
+        stage = "收集参数"
+        try:
+            # 收集参数
+            with self._stats.measure("收集参数", entry.key):
+                meme_images, texts, options = await deadline.wait(
+                    self._profiled(profile, "收集参数", self._get_parms(event, keyword, entry, deadline))
+                )
+
+            # 参数不合法时直接提示，不交给生成器
+            if error := self._validate_options(entry, options):
+                yield event.plain_result(error)
+                return
+
+            # 预处理输入图片（在渲染线程池中执行），结果同时用于缓存键
+            if meme_images and (self.input_max_size > 0 or self.input_max_frames > 0):
+                stage = "预处理图片"
+                with self._stats.measure("预处理图片", entry.key):
+                    meme_images = await deadline.wait(
+                        self.render_executor.run(self._normalize_inputs, meme_images)
+                    )
+
+            # 相同请求直接使用缓存的结果
+            cache_key = self._render_cache_key(entry, meme_images, texts, options)
+            if cache_key and (cached_image := self._render_cache.get(cache_key)):
+                logger.debug(f"使用缓存的合成结果: {entry.key}")
+                self._stats.events["合成缓存命中"] += 1
+                yield event.chain_result([Comp.Image.fromBytes(cached_image)])  # type: ignore
+                self._stats.record("总计", time.perf_counter() - request_start, entry.key)
+                return
+            if cache_key:
+                self._stats.events["合成缓存未命中"] += 1
 
-        # 压缩图片
-        if self.is_compress_image:
             try:
-                image = self.compress_image(image) or image
-            except:  # noqa: E722
-                pass
+                with self.render_executor.slot(session_key) as render_slot:
+                    # 合成表情（超时时尚在排队的任务会被取消）
+                    stage = "排队合成"
+                    image: bytes = await deadline.wait(
+                        self._profiled(profile, "合成", self._meme_generate(entry.meme, meme_images, texts, options, render_slot))
+                    )
+
+                    # 压缩图片（在渲染线程池中执行，不阻塞事件循环）
+                    if self.is_compress_image:
+                        stage = "压缩图片"
+                        try:
+                            with self._stats.measure("压缩图片", entry.key):
+                                image = await deadline.wait(
+                                    self.render_executor.run_in_slot(render_slot, self._compress_output, image)
+                                )
+                        except asyncio.TimeoutError:
+                            raise
+                        except Exception as e:
+                            self._stats.errors[type(e).__name__] += 1
+                            logger.warning(f"压缩图片失败，发送原图: {e}")
+            except RenderBusyError:
+                self._dropped["队列已满"] += 1
+                yield event.plain_result(RENDER_BUSY_MESSAGE)
+                return
+        except asyncio.TimeoutError:
+            self._dropped["超时"] += 1
+            self._stats.errors["TimeoutError"] += 1
+            logger.warning(f"meme {entry.key} 处理超时（{self.request_timeout}秒），超时阶段：{stage}")
+            yield event.plain_result(REQUEST_TIMEOUT_MESSAGE)
+            return
+        except Exception as e:
+            self._stats.errors[type(e).__name__] += 1
+            raise
+        finally:
+            if profile is not None and self._profiler.finish(profile):
+                self._spawn(asyncio.to_thread(self._profiler.write_report, profile))
+
+        if cache_key:
+            self._render_cache.put(cache_key, image)
 
-        # 发送图片
+        # 发送图片（框架在生成器恢复前完成发送，这段时间近似为发送耗时）
         chain = [Comp.Image.fromBytes(image)]
-        yield event.chain_result(chain)  # type: ignore
+        with self._stats.measure("发送", entry.key):
+            yield event.chain_result(chain)  # type: ignore
+        self._stats.record("总计", time.perf_counter() - request_start, entry.key)
+
+    @staticmethod
+    def _profiled(profile: ProfileSession | None, stage: str, aw):
+        """需要分析时在该阶段开启性能分析"""
+        return aw if profile is None else profile.measure(stage, aw)
+
+    def _render_cache_key(
+        self, entry: MemeEntry, meme_images: list[tuple[str, bytes]], texts: list[str], options: dict
+    ) -> str | None:
+        """合成结果缓存的键，不可缓存时返回 None"""
+        if not self._render_cache.enabled:
+            return None
+        if entry.key in self.render_cache_exclude or not self.render_cache_exclude.isdisjoint(entry.keywords):
+            return None
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps(
+            [
+                entry.key,
+                [name for name, _ in meme_images],
+                texts,
+                sorted(options.items()),
+                self.is_compress_image,
+                self.compress_max_size,
+                self.gif_max_size,
+                self.gif_max_frames,
+                self.gif_max_bytes,
+            ],
+            ensure_ascii=False,
+            default=str,
+        ).encode())
+        for _, data in meme_images:
+            hasher.update(hashlib.sha256(data).digest())
+        return hasher.hexdigest()
 
-    def _find_meme(self, keyword: str) -> Meme | None:
-        """根据关键词寻找meme"""
-        for meme in self.memes:
-            if keyword == meme.key or any(k == keyword for k in meme.info.keywords):
-                return meme
+    @staticmethod
+    def _get_session_key(event: AstrMessageEvent) -> str:
+        """渲染限流的会话标识：群聊按群，私聊按用户"""
+        group_id = event.get_group_id()
+        if group_id:
+            return f"group:{group_id}"
+        return f"user:{event.get_sender_id()}"
+
+    async def _get_parms(
+        self, event: AstrMessageEvent, keyword: str, entry: MemeEntry, deadline: Deadline | None = None
+    ):
+        """收集参数
 
-    async def _get_parms(self, event: AstrMessageEvent, keyword: str, meme: Meme):
-        """收集参数"""
-        meme_images: list[MemeImage] = []
+        先按消息顺序登记所有需要的图片、头像和用户信息，网络请求全部并发执行，
+        再按登记顺序组装结果，图片和文本的顺序与逐个获取时完全一致
+        """
+        meme_images: list[tuple[str, bytes]] = []  # (名称, 图片数据)
         texts: List[str] = []
         options: dict[str, Union[bool, str, int, float]] = {}
 
-        params = meme.info.params
-        min_images: int = params.min_images  # noqa: F841
-        max_images: int = params.max_images
-        min_texts: int = params.min_texts
-        max_texts: int = params.max_texts
-        default_texts: list[str] = params.default_texts
+        max_images: int = entry.max_images
+        min_texts: int = entry.min_texts
+        max_texts: int = entry.max_texts
+        default_texts: list[str] = list(entry.default_texts)
 
         messages = event.get_messages()
         send_id: str = event.get_sender_id()
@@ -1097,13 +2839,20 @@ class MemePlugin(Star):
         target_names: list[str] = []
         all_text_parts: list[str] = []  # 收集所有文本用于参数解析
 
-        async def _process_segment(_seg, name):
-            """从消息段中获取参数"""
+        # 按顺序登记的图片来源：("image", 名称, 图片数据或下载任务) / ("at", 头像任务, 额外信息任务)
+        slots: list[tuple] = []
+        tasks: list[asyncio.Future] = []
+
+        def _start(coro) -> asyncio.Future:
+            task = asyncio.ensure_future(coro)
+            tasks.append(task)
+            return task
+
+        def _collect_segment(_seg, name):
+            """从消息段中登记参数"""
             if isinstance(_seg, Comp.Image):
                 if hasattr(_seg, "url") and _seg.url:
-                    img_url = _seg.url
-                    if file_content := await self.download_image(img_url):
-                        meme_images.append(MemeImage(name, file_content))
+                    slots.append(("image", name, _start(self.download_image(_seg.url))))
 
                 elif hasattr(_seg, "file"):
                     file_content = _seg.file
@@ -1112,19 +2861,20 @@ class MemePlugin(Star):
                             file_content = file_content[len("base64://") :]
                         file_content = base64.b64decode(file_content)
                     if isinstance(file_content, bytes):
-                        meme_images.append(MemeImage(name, file_content))
+                        slots.append(("image", name, file_content))
 
             elif isinstance(_seg, Comp.At):
                 seg_qq = str(_seg.qq)
                 if seg_qq != self_id:
                     target_ids.append(seg_qq)
-                    if at_avatar := await self.get_avatar(event, seg_qq):
-                        # 从消息平台获取At者的额外参数
-                        if result := await self._get_extra(event, target_id=seg_qq):
-                            nickname, sex = result
-                            options["name"], options["gender"] = nickname, sex
-                            target_names.append(nickname)
-                            meme_images.append(MemeImage(nickname, at_avatar))
+                    # 头像和At者的额外参数同时获取
+                    slots.append((
+                        "at",
+                        _start(self.get_avatar(event, seg_qq)),
+                        _start(self._get_extra(
+                            event, target_id=seg_qq, fallback_name=getattr(_seg, "name", None) or sender_name
+                        )),
+                    ))
 
             elif isinstance(_seg, Comp.Plain):
                 plains: list[str] = _seg.text.strip().split()
@@ -1136,20 +2886,53 @@ class MemePlugin(Star):
         reply_seg = next((seg for seg in messages if isinstance(seg, Comp.Reply)), None)
         if reply_seg and reply_seg.chain:
             for seg in reply_seg.chain:
-                await _process_segment(seg, "这家伙")
+                _collect_segment(seg, "这家伙")
 
         # 遍历原始消息段落
         for seg in messages:
-            await _process_segment(seg, sender_name)
+            _collect_segment(seg, sender_name)
+
+        # 从消息平台获取发送者的额外参数
+        sender_extra_task = None
+        if not target_ids:
+            sender_extra_task = _start(self._get_extra(event, target_id=send_id, fallback_name=sender_name))
+
+        # 图片来源不足时一定会用到发送者和bot的头像，提前并发获取
+        sender_avatar_task = bot_avatar_task = None
+        if len(slots) < max_images:
+            sender_avatar_task = _start(self.get_avatar(event, send_id))
+        if len(slots) + 1 < max_images:
+            bot_avatar_task = _start(self.get_avatar(event, self_id))
+
+        # 收集参数超时与请求剩余时间取较小者
+        timeouts = [self.param_timeout] if self.param_timeout > 0 else []
+        if deadline is not None and (remaining := deadline.remaining()) is not None:
+            timeouts.append(remaining)
+        await self._wait_tasks(tasks, min(timeouts) if timeouts else None)
+
+        # 按登记顺序组装图片
+        for slot in slots:
+            if slot[0] == "image":
+                _, name, source = slot
+                file_content = self._task_result(source) if isinstance(source, asyncio.Future) else source
+                if file_content:
+                    meme_images.append((name, file_content))
+            else:
+                _, avatar_task, extra_task = slot
+                if at_avatar := self._task_result(avatar_task):
+                    if result := self._task_result(extra_task):
+                        nickname, sex = result
+                        options["name"], options["gender"] = nickname, sex
+                        target_names.append(nickname)
+                        meme_images.append((nickname, at_avatar))
 
         # 解析命令行参数并获取剩余文本
-        remaining_texts, parsed_options = self._parse_meme_options(meme, all_text_parts)
+        remaining_texts, parsed_options = self._parse_meme_options(entry, all_text_parts)
         texts.extend(remaining_texts)
         options.update(parsed_options)
 
-        # 从消息平台获取发送者的额外参数
-        if not target_ids:
-            if result := await self._get_extra(event, target_id=send_id):
+        if sender_extra_task is not None:
+            if result := self._task_result(sender_extra_task):
                 nickname, sex = result
                 options["name"], options["gender"] = nickname, sex
                 target_names.append(nickname)
@@ -1159,11 +2942,19 @@ class MemePlugin(Star):
 
         # 确保图片数量在min_images到max_images之间(尽可能地获取图片)
         if len(meme_images) < max_images:
-            if use_avatar := await self.get_avatar(event, send_id):
-                meme_images.insert(0, MemeImage(sender_name, use_avatar))
+            if sender_avatar_task is not None:
+                use_avatar = self._task_result(sender_avatar_task)
+            else:
+                use_avatar = await self.get_avatar(event, send_id)
+            if use_avatar:
+                meme_images.insert(0, (sender_name, use_avatar))
         if len(meme_images) < max_images:
-            if bot_avatar := await self.get_avatar(event, self_id):
-                meme_images.insert(0, MemeImage("我", bot_avatar))
+            if bot_avatar_task is not None:
+                bot_avatar = self._task_result(bot_avatar_task)
+            else:
+                bot_avatar = await self.get_avatar(event, self_id)
+            if bot_avatar:
+                meme_images.insert(0, ("我", bot_avatar))
         meme_images = meme_images[:max_images]
 
         # 确保文本数量在min_texts到max_texts之间(文本参数足够即可)
@@ -1176,122 +2967,107 @@ class MemePlugin(Star):
         return meme_images, texts, options
 
     @staticmethod
+    async def _wait_tasks(tasks: list[asyncio.Future], timeout: float | None) -> None:
+        """等待所有任务完成，超时或自身被取消时取消仍未完成的任务"""
+        if not tasks:
+            return
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        if pending:
+            logger.warning(f"收集参数超时（{timeout:.1f}秒），放弃 {len(pending)} 个未完成的请求")
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def _task_result(task: asyncio.Future):
+        """获取任务结果，未完成、被取消或出错时返回 None"""
+        if not task.done() or task.cancelled():
+            return None
+        if exc := task.exception():
+            logger.warning(f"获取参数失败: {exc!r}")
+            return None
+        return task.result()
+
     async def _meme_generate(
-        meme: Meme, meme_images: list[MemeImage], texts: list[str], options
+        self,
+        meme: Meme,
+        meme_images: list[tuple[str, bytes]],
+        texts: list[str],
+        options,
+        slot: RenderSlot | None = None,
     ) -> bytes:
         """向meme生成器发出请求，返回生成的图片"""
 
-        # 将同步函数运行在默认的线程池中
-        result = await asyncio.to_thread(meme.generate, meme_images, texts, options)
-
-        if result is None:
-            logger.error("返回内容为空")
-        elif isinstance(result, ImageDecodeError):
-            logger.error(f"图片解码出错：{result.error}")
-        elif isinstance(result, ImageEncodeError):
-            logger.error(f"图片编码出错：{result.error}")
-        elif isinstance(result, ImageAssetMissing):
-            logger.error(f"缺少图片资源：{result.path}")
-        elif isinstance(result, DeserializeError):
-            logger.error(f"表情选项解析出错：{result.error}")
-        elif isinstance(result, ImageNumberMismatch):
-            num = (
-                f"{result.min} ~ {result.max}"
-                if result.min != result.max
-                else str(result.min)
-            )
-            logger.error(f"图片数量不符，应为 {num}，实际传入 {result.actual}")
-        elif isinstance(result, TextNumberMismatch):
-            num = (
-                f"{result.min} ~ {result.max}"
-                if result.min != result.max
-                else str(result.min)
-            )
-            logger.error(f"文字数量不符，应为 {num}，实际传入 {result.actual}")
-        elif isinstance(result, TextOverLength):
-            text = result.text
-            repr = text if len(text) <= 10 else (text[:10] + "...")
-            logger.error(f"文字过长：{repr}")
-        elif isinstance(result, MemeFeedback):
-            logger.error(result.feedback)
+        # 在渲染专用的线程池或进程池中执行
+        result = await self.render_executor.render(meme, meme_images, texts, options, slot)
 
         if not isinstance(result, bytes):
+            logger.error(result)
             raise NotImplementedError
 
         return result
 
-    def _get_cached_avatar(self, user_id: str) -> bytes | None:
-        """从缓存中获取头像"""
-        if user_id in self._avatar_cache:
-            avatar_data, timestamp = self._avatar_cache[user_id]
-            # 将访问的项移到末尾（更新访问时间）
-            self._avatar_cache.move_to_end(user_id)
-            return avatar_data
-        return None
-
-    def _get_cache_size_bytes(self) -> int:
-        """获取当前缓存占用的总字节数"""
-        return sum(len(avatar_data) for avatar_data, _ in self._avatar_cache.values())
+    async def _get_extra(self, event: AstrMessageEvent, target_id: str, fallback_name: str | None = None):
+        """从消息平台获取参数（带缓存，超时或出错时以 fallback_name 作为昵称、性别为 unknown）"""
+        if event.get_platform_name() != "aiocqhttp":
+            # TODO 适配更多消息平台
+            return None
 
-    def _cache_avatar(self, user_id: str, avatar_data: bytes) -> None:
-        """缓存头像数据"""
-        # 如果缓存被禁用（max_cache_size为0），直接返回
-        if self._max_cache_size <= 0:
-            return
-        
-        # 如果已存在，先删除旧的
-        if user_id in self._avatar_cache:
-            del self._avatar_cache[user_id]
-        
-        # 检查数量限制：如果缓存已满，删除最旧的（第一个）
-        while len(self._avatar_cache) >= self._max_cache_size:
-            oldest_key = next(iter(self._avatar_cache))
-            del self._avatar_cache[oldest_key]
-            logger.debug(f"缓存数量已满，删除最旧的头像缓存: {oldest_key}")
-        
-        # 检查内存限制：如果添加新头像后会超过内存限制，删除最旧的缓存
-        while self._avatar_cache and (self._get_cache_size_bytes() + len(avatar_data)) > self._max_cache_size_bytes:
-            oldest_key = next(iter(self._avatar_cache))
-            del self._avatar_cache[oldest_key]
-            logger.debug(f"缓存内存已满，删除最旧的头像缓存: {oldest_key}")
-        
-        # 添加新的头像到缓存
-        self._avatar_cache[user_id] = (avatar_data, time.time())
-        logger.debug(f"头像已缓存: {user_id}，当前缓存数量: {len(self._avatar_cache)}，占用内存: {self._get_cache_size_bytes() // 1024} KB")
+        if cached := self._user_info_cache.get(target_id):
+            self._stats.events["用户信息缓存命中"] += 1
+            return cached
+        try:
+            with self._stats.measure("用户信息"):
+                return await asyncio.wait_for(
+                    self._user_info_flight.do(target_id, lambda: self._fetch_user_info(event, target_id)),
+                    timeout=self.user_info_timeout if self.user_info_timeout > 0 else None,
+                )
+        except asyncio.TimeoutError:
+            logger.warning(f"获取用户 {target_id} 信息超时，使用默认昵称")
+        except Exception as e:
+            logger.warning(f"获取用户 {target_id} 信息失败: {e}")
+        if fallback_name is None:
+            return None
+        # 性别未知时使用 "unknown"，选项值不能为 None（生成器只接受 bool/str/int/float）
+        return fallback_name, UNKNOWN_GENDER
 
-    @staticmethod
-    async def _get_extra(event: AstrMessageEvent, target_id: str):
-        """从消息平台获取参数"""
-        if event.get_platform_name() == "aiocqhttp":
-            from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
-                AiocqhttpMessageEvent,
-            )
+    async def _fetch_user_info(self, event: AstrMessageEvent, target_id: str) -> tuple[str, Any]:
+        """调用 get_stranger_info 获取昵称和性别，并写入缓存"""
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
+            AiocqhttpMessageEvent,
+        )
 
-            assert isinstance(event, AiocqhttpMessageEvent)
-            client = event.bot
-            user_info = await client.get_stranger_info(user_id=int(target_id))
-            raw_nickname = user_info.get("nickname")
-            nickname = str(raw_nickname if raw_nickname is not None else "Unknown")
-            sex = user_info.get("sex")
-            return nickname, sex
-        # TODO 适配更多消息平台
+        assert isinstance(event, AiocqhttpMessageEvent)
+        client = event.bot
+        user_info = await client.get_stranger_info(user_id=int(target_id))
+        raw_nickname = user_info.get("nickname")
+        nickname = str(raw_nickname if raw_nickname is not None else "Unknown")
+        sex = user_info.get("sex") or UNKNOWN_GENDER
+        self._user_info_cache.put(target_id, (nickname, sex))
+        return nickname, sex
 
     @staticmethod
     def compress_image(image: bytes, max_size: int = 512) -> bytes | None:
-        """压缩静态图片或GIF到max_size大小"""
+        """压缩静态图片到max_size大小，无需缩放时原样返回，GIF返回None"""
         try:
-            # 将输入的bytes加载为图片
+            # Image.open 只解析文件头，尺寸判断不需要解码整张图片
             img = Image.open(io.BytesIO(image))
-            output = io.BytesIO()
 
             if img.format == "GIF":
                 return
-            else:
-                # 如果是静态图片，检查尺寸并压缩
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                # 保存处理后的图片到内存中的BytesIO对象
-                img.save(output, format=img.format)
+            if img.width <= max_size and img.height <= max_size:
+                # 尺寸已达标，跳过解码和重新编码
+                return image
+
+            # 如果是静态图片，按比例缩小
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            # 保存处理后的图片到内存中的BytesIO对象
+            output = io.BytesIO()
+            img.save(output, format=img.format)
 
             # 返回处理后的图片数据（bytes）
             return output.getvalue()
@@ -1300,47 +3076,253 @@ class MemePlugin(Star):
             raise ValueError(f"图片压缩失败: {e}")
 
     @staticmethod
-    async def download_image(url: str) -> bytes | None:
-        """下载图片"""
-        url = url.replace("https://", "http://")
+    def compress_gif(image: bytes, max_size: int = 512, max_frames: int = 0, max_bytes: int = 0) -> bytes:
+        """压缩GIF：缩小所有帧、抽帧、重新量化调色板，尽量满足 max_bytes（0 表示不限制）"""
+        try:
+            img = Image.open(io.BytesIO(image))
+            if img.format != "GIF":
+                return image
+            n_frames = getattr(img, "n_frames", 1)
+            too_large = max_size > 0 and (img.width > max_size or img.height > max_size)
+            too_many = max_frames > 0 and n_frames > max_frames
+            too_heavy = max_bytes > 0 and len(image) > max_bytes
+            if not (too_large or too_many or too_heavy):
+                return image
+
+            # 读取所有帧并统一缩放
+            loop = img.info.get("loop", 0)
+            frames: list[Image.Image] = []
+            durations: list[int] = []
+            for frame in ImageSequence.Iterator(img):
+                durations.append(frame.info.get("duration", img.info.get("duration", 100)) or 100)
+                frame = frame.convert("RGBA")
+                if too_large:
+                    frame.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                frames.append(frame)
+
+            def _quantize(frame: Image.Image, colors: int) -> Image.Image:
+                # 留出最后一个调色板索引作为透明色
+                quantized = frame.convert("RGB").quantize(colors=colors - 1, method=Image.Quantize.FASTOCTREE)
+                alpha = frame.getchannel("A")
+                if alpha.getextrema()[0] < 128:
+                    quantized.paste(colors - 1, mask=alpha.point(lambda a: 255 if a < 128 else 0))
+                    quantized.info["transparency"] = colors - 1
+                return quantized
+
+            def _encode(step: int, colors: int) -> bytes:
+                # 每 step 帧保留一帧，被丢弃帧的时长并入保留帧，保持总时长不变
+                kept = frames[::step]
+                kept_durations = [sum(durations[i : i + step]) for i in range(0, len(frames), step)]
+                if colors < 256:
+                    kept = [_quantize(frame, colors) for frame in kept]
+                output = io.BytesIO()
+                kept[0].save(
+                    output,
+                    format="GIF",
+                    save_all=True,
+                    append_images=kept[1:],
+                    duration=kept_durations,
+                    loop=loop,
+                    disposal=2,
+                    optimize=True,
+                )
+                return output.getvalue()
+
+            step = math.ceil(len(frames) / max_frames) if too_many else 1
+            colors = 256
+            result = _encode(step, colors)
+            smallest = result
+            # 体积仍然超标时先抽帧（至少保留 GIF_MIN_FRAMES 帧，保证仍是动图），抽到下限后再逐步减少颜色数。
+            # 体积大致与帧数成正比，按超出的比例估算保留帧数（留一成余量），通常一两轮即可
+            min_kept = min(len(frames), GIF_MIN_FRAMES)
+            # 保留帧数不少于 min_kept 时允许的最大抽帧间隔
+            max_step = math.ceil(len(frames) / (min_kept - 1)) - 1 if min_kept > 1 else len(frames)
+            while max_bytes > 0 and len(result) > max_bytes:
+                kept = math.ceil(len(frames) / step)
+                target = max(1, min(kept - 1, int(kept * max_bytes / len(result) * 0.9)))
+                next_step = min(math.ceil(len(frames) / target), max_step)
+                if next_step > step:
+                    step = next_step
+                    colors = min(colors, 128)
+                elif colors > GIF_MIN_COLORS:
+                    colors //= 2
+                else:
+                    break
+                result = _encode(step, colors)
+                if len(result) < len(smallest):
+                    smallest = result
+
+            # 达不到目标时返回体积最小的一次结果（仍是动图）
+            if len(smallest) < len(result):
+                result = smallest
+            return result if len(result) < len(image) or too_large or too_many else image
+
+        except Exception as e:
+            raise ValueError(f"GIF压缩失败: {e}")
+
+    @staticmethod
+    def normalize_input(image: bytes, max_size: int = 1024, max_frames: int = 0) -> bytes:
+        """合成前预处理输入图片：缩小超过max_size的图片，GIF抽帧到max_frames以内，无需处理时原样返回"""
+        try:
+            # 只解析文件头判断尺寸和帧数
+            img = Image.open(io.BytesIO(image))
+            if img.format == "GIF":
+                return MemePlugin.compress_gif(image, max_size, max_frames)
+            if max_size <= 0 or (img.width <= max_size and img.height <= max_size):
+                return image
+
+            # 按图片的EXIF方向摆正后再缩小，避免重新编码后丢失方向信息
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            if img.mode in ("RGBA", "LA", "P"):
+                img.save(output, format="PNG", optimize=True)
+            else:
+                img.convert("RGB").save(output, format="JPEG", quality=90)
+            return output.getvalue()
+        except Exception as e:
+            # 无法识别的图片原样交给生成器，由生成器给出解码错误
+            logger.debug(f"预处理图片失败，使用原图: {e}")
+            return image
+
+    def _normalize_inputs(self, images: list[tuple[str, bytes]]) -> list[tuple[str, bytes]]:
+        """预处理全部输入图片"""
+        return [
+            (name, self.normalize_input(data, self.input_max_size, self.input_max_frames))
+            for name, data in images
+        ]
+
+    def _compress_output(self, image: bytes) -> bytes:
+        """压缩合成结果：静态图按尺寸缩放，GIF按尺寸、帧数和体积压缩"""
+        if image[:6] in (b"GIF87a", b"GIF89a"):
+            return self.compress_gif(image, self.gif_max_size, self.gif_max_frames, self.gif_max_bytes)
+        return self.compress_image(image, self.compress_max_size) or image
+
+    async def download_image(self, url: str) -> bytes | None:
+        """下载图片（同一链接的并发请求只下载一次）"""
+        if self.download_force_http:
+            url = url.replace("https://", "http://")
+        return await self._image_flight.do(url, lambda: self._fetch_image(url))
+
+    async def _fetch_image(self, url: str) -> bytes | None:
+        """实际执行图片下载（流式读取，超过大小限制或超时即中止）"""
         try:
-            async with aiohttp.ClientSession() as client:
-                response = await client.get(url)
-                img_bytes = await response.read()
-                return img_bytes
+            client = await self._get_session()
+            timeout = aiohttp.ClientTimeout(total=self.download_timeout or None)
+            with self._stats.measure("下载图片"):
+                async with client.get(url, timeout=timeout) as response:
+                    return await self._read_image_body(response)
+        except asyncio.TimeoutError:
+            self._stats.errors["下载图片超时"] += 1
+            logger.error(f"图片下载超时（{self.download_timeout}秒）: {url}")
         except Exception as e:
+            self._stats.errors[type(e).__name__] += 1
             logger.error(f"图片下载失败: {e}")
 
+    async def _read_image_body(self, response: aiohttp.ClientResponse) -> bytes:
+        """检查状态码和内容类型后分块读取响应，超过 download_max_bytes 时抛出 ValueError"""
+        response.raise_for_status()
+        content_type = response.content_type
+        if content_type and not content_type.startswith("image/") and content_type not in DOWNLOAD_GENERIC_TYPES:
+            raise ValueError(f"不是图片类型: {content_type}")
+
+        max_bytes = self.download_max_bytes
+        length = response.content_length
+        if max_bytes > 0 and length is not None and length > max_bytes:
+            raise ValueError(f"图片过大: {length // 1024} KB，上限 {max_bytes // 1024} KB")
+
+        # 已知长度且不超过上限时预先分配缓冲区，否则逐块追加（压缩传输时解压后的长度未知）。
+        # 不限制大小时不按 Content-Length 预分配，避免伪造的长度直接申请大量内存
+        if length is not None and ("Content-Encoding" in response.headers or max_bytes <= 0):
+            length = None
+        if length is not None:
+            buffer = bytearray(length)
+            view = memoryview(buffer)
+            received = 0
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                end = received + len(chunk)
+                if end > length:
+                    raise ValueError("响应内容超过 Content-Length")
+                view[received:end] = chunk
+                received = end
+            view.release()
+            if received != length:
+                raise ValueError(f"响应内容不完整: {received}/{length} 字节")
+            return bytes(buffer)
+
+        buffer = bytearray()
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if max_bytes > 0 and len(buffer) > max_bytes:
+                raise ValueError(f"图片过大，超过上限 {max_bytes // 1024} KB")
+        return bytes(buffer)
+
     async def get_avatar(self, event: AstrMessageEvent, user_id: str) -> bytes | None:
         """下载头像（带缓存功能）"""
         # 如果缓存被禁用，直接下载
-        if self._max_cache_size <= 0:
+        if not self._avatar_cache.enabled:
             logger.debug("头像缓存已禁用，直接下载")
         else:
             # 先尝试从缓存获取
-            cached_avatar = self._get_cached_avatar(user_id)
+            cached_avatar = self._avatar_cache.get(user_id)
             if cached_avatar:
                 logger.debug(f"从缓存获取头像: {user_id}")
+                self._stats.events["头像缓存命中"] += 1
+                # 超过软过期时间：先返回旧头像，后台刷新
+                if self._avatar_cache.is_stale(user_id):
+                    self._refresh_avatar_in_background(user_id)
                 return cached_avatar
-        
-        # 缓存中没有或缓存被禁用，下载头像
-        if not user_id.isdigit():
-            user_id = "".join(random.choices("0123456789", k=9))
-        avatar_url = f"https://q4.qlogo.cn/headimg_dl?dst_uin={user_id}&spec=640"
+
+            # 内存中没有，再查磁盘缓存
+            if self._avatar_disk_cache is not None:
+                disk_item = await asyncio.to_thread(self._avatar_disk_cache.get, user_id)
+                if disk_item:
+                    avatar_data, fetched_at = disk_item
+                    logger.debug(f"从磁盘缓存获取头像: {user_id}")
+                    self._stats.events["头像磁盘缓存命中"] += 1
+                    self._avatar_cache.put(user_id, avatar_data, fetched_at)
+                    if self._avatar_cache.is_stale(user_id):
+                        self._refresh_avatar_in_background(user_id)
+                    return avatar_data
+        
+        # 缓存中没有、已硬过期或缓存被禁用，下载头像（同一用户的并发请求只下载一次）
+        return await self._avatar_flight.do(user_id, lambda: self._fetch_avatar(user_id))
+
+    def _refresh_avatar_in_background(self, user_id: str) -> None:
+        """后台刷新头像，同一用户同时只有一个刷新任务"""
+        if user_id in self._avatar_refresh_tasks:
+            return
+        task = asyncio.create_task(
+            self._avatar_flight.do(user_id, lambda: self._fetch_avatar(user_id))
+        )
+        self._avatar_refresh_tasks[user_id] = task
+        task.add_done_callback(lambda _: self._avatar_refresh_tasks.pop(user_id, None))
+        logger.debug(f"头像已过期，后台刷新: {user_id}")
+
+    async def _fetch_avatar(self, user_id: str) -> bytes | None:
+        """从 qlogo 下载头像并写入缓存"""
+        uin = user_id
+        if not uin.isdigit():
+            # 非QQ平台的用户ID由ID哈希出固定的9位号码，同一用户每次得到相同的头像，可正常缓存
+            uin = str(int.from_bytes(hashlib.sha256(user_id.encode()).digest()[:8], "big") % 900000000 + 100000000)
+        avatar_url = f"https://q4.qlogo.cn/headimg_dl?dst_uin={uin}&spec=640"
         try:
-            async with aiohttp.ClientSession() as client:
-                response = await client.get(avatar_url, timeout=10)
-                response.raise_for_status()
-                avatar_data = await response.read()
+            client = await self._get_session()
+            with self._stats.measure("下载头像"):
+                async with client.get(avatar_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    avatar_data = await self._read_image_body(response)
                 
-                # 如果缓存未禁用，缓存头像数据
-                if self._max_cache_size > 0:
-                    self._cache_avatar(user_id, avatar_data)
-                    logger.debug(f"下载并缓存头像: {user_id}")
-                else:
-                    logger.debug(f"下载头像（缓存已禁用）: {user_id}")
-                
-                return avatar_data
+            # 如果缓存未禁用，缓存头像数据
+            if self._avatar_cache.enabled:
+                self._avatar_cache.put(user_id, avatar_data)
+                if self._avatar_disk_cache is not None:
+                    self._spawn(asyncio.to_thread(self._avatar_disk_cache.put, user_id, avatar_data))
+                logger.debug(f"下载并缓存头像: {user_id}，当前缓存数量: {len(self._avatar_cache)}，占用内存: {self._avatar_cache.total_bytes // 1024} KB")
+            else:
+                logger.debug(f"下载头像（缓存已禁用）: {user_id}")
+            
+            return avatar_data
         except Exception as e:
+            self._stats.errors[type(e).__name__] += 1
             logger.error(f"下载头像失败: {e}")
             return None
@@ -0,0 +1,88 @@
+"""meme渲染函数
+
+本模块只依赖 meme_generator，自身不导入 astrbot，也不依赖插件的 main 模块。
+线程模式下由插件直接调用 render()；进程模式下子进程启动时调用 init_worker()
+加载一次全部meme，之后通过 render_by_key() 按 meme key 渲染。
+
+注意：进程模式使用 spawn 启动子进程，multiprocessing 会在子进程中把主进程的
+__main__（AstrBot 的启动脚本）重新导入为 __mp_main__，所以子进程里仍会执行其
+顶层 import（包括 astrbot），只是不会运行 `if __name__ == "__main__"` 中的启动逻辑。
+"""
+
+from meme_generator import (
+    DeserializeError,
+    ImageAssetMissing,
+    ImageDecodeError,
+    ImageEncodeError,
+    ImageNumberMismatch,
+    MemeFeedback,
+    TextNumberMismatch,
+    TextOverLength,
+)
+from meme_generator import Meme, get_memes
+from meme_generator import Image as MemeImage
+
+# 子进程内的 meme key -> Meme
+_memes: dict[str, Meme] = {}
+
+
+def format_meme_error(result) -> str:
+    """把 meme.generate 的错误结果转为可读的错误信息"""
+    if result is None:
+        return "返回内容为空"
+    elif isinstance(result, ImageDecodeError):
+        return f"图片解码出错：{result.error}"
+    elif isinstance(result, ImageEncodeError):
+        return f"图片编码出错：{result.error}"
+    elif isinstance(result, ImageAssetMissing):
+        return f"缺少图片资源：{result.path}"
+    elif isinstance(result, DeserializeError):
+        return f"表情选项解析出错：{result.error}"
+    elif isinstance(result, ImageNumberMismatch):
+        num = (
+            f"{result.min} ~ {result.max}"
+            if result.min != result.max
+            else str(result.min)
+        )
+        return f"图片数量不符，应为 {num}，实际传入 {result.actual}"
+    elif isinstance(result, TextNumberMismatch):
+        num = (
+            f"{result.min} ~ {result.max}"
+            if result.min != result.max
+            else str(result.min)
+        )
+        return f"文字数量不符，应为 {num}，实际传入 {result.actual}"
+    elif isinstance(result, TextOverLength):
+        text = result.text
+        repr = text if len(text) <= 10 else (text[:10] + "...")
+        return f"文字过长：{repr}"
+    elif isinstance(result, MemeFeedback):
+        return str(result.feedback)
+    return f"未知的返回类型：{type(result).__name__}"
+
+
+def render(
+    meme: Meme, images: list[tuple[str, bytes]], texts: list[str], options: dict
+) -> bytes | str:
+    """渲染meme，成功返回图片数据，失败返回错误信息"""
+    meme_images = [MemeImage(name, data) for name, data in images]
+    result = meme.generate(meme_images, texts, options)
+    if isinstance(result, bytes):
+        return result
+    return format_meme_error(result)
+
+
+def init_worker() -> None:
+    """渲染子进程初始化：加载一次全部meme"""
+    global _memes
+    _memes = {meme.key: meme for meme in get_memes()}
+
+
+def render_by_key(
+    meme_key: str, images: list[tuple[str, bytes]], texts: list[str], options: dict
+) -> bytes | str:
+    """在子进程中按 meme key 渲染"""
+    meme = _memes.get(meme_key)
+    if meme is None:
+        return f"渲染进程中不存在该meme：{meme_key}"
+    return render(meme, images, texts, options)
@@ -0,0 +1,61 @@
+import importlib
+import sys
+import types
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+PLUGIN_PACKAGE = "astrbot_plugin_memelite_rs"
+
+
+@pytest.fixture(scope="session")
+def plugin_module():
+    """按 AstrBot 的方式把插件目录作为包导入，返回其中的 main 模块"""
+    pytest.importorskip("astrbot")
+    pytest.importorskip("meme_generator")
+    if PLUGIN_PACKAGE not in sys.modules:
+        package = types.ModuleType(PLUGIN_PACKAGE)
+        package.__path__ = [str(PLUGIN_DIR)]
+        sys.modules[PLUGIN_PACKAGE] = package
+    return importlib.import_module(f"{PLUGIN_PACKAGE}.main")
+
+
+@pytest.fixture
+def make_plugin(plugin_module, tmp_path, monkeypatch):
+    """创建插件实例，数据目录指向临时目录，默认关闭磁盘缓存和资源检查"""
+    monkeypatch.setattr(plugin_module.MemePlugin, "_get_data_dir", staticmethod(lambda: tmp_path))
+
+    def _make(**config):
+        defaults = {
+            "is_check_resources": False,
+            "avatar_disk_cache_enabled": False,
+            "help_list_disk_cache": False,
+            "preview_disk_cache": False,
+        }
+        return plugin_module.MemePlugin(None, {**defaults, **config})
+
+    return _make
+
+
+@asynccontextmanager
+async def serve(routes: dict):
+    """启动本地 HTTP 服务，routes 为 路径 -> 处理函数，返回服务地址"""
+    app = web.Application()
+    app.add_routes([web.get(path, handler) for path, handler in routes.items()])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def local_server():
+    return serve
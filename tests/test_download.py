@@ -0,0 +1,119 @@
+import asyncio
+
+from aiohttp import web
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096
+
+
+async def _ok(request: web.Request) -> web.Response:
+    return web.Response(body=PNG, content_type="image/png")
+
+
+async def _octet_stream(request: web.Request) -> web.Response:
+    return web.Response(body=PNG, content_type="application/octet-stream")
+
+
+async def _gzip(request: web.Request) -> web.Response:
+    response = web.Response(body=PNG * 64, content_type="image/png")
+    response.enable_compression()
+    return response
+
+
+async def _html(request: web.Request) -> web.Response:
+    return web.Response(text="<html></html>", content_type="text/html")
+
+
+async def _not_found(request: web.Request) -> web.Response:
+    return web.Response(status=404, body=PNG, content_type="image/png")
+
+
+async def _huge_declared(request: web.Request) -> web.Response:
+    return web.Response(body=b"\x00" * (3 * 1024 * 1024), content_type="image/png")
+
+
+async def _huge_streamed(request: web.Request) -> web.StreamResponse:
+    # 不带 Content-Length 的分块响应，只能在读取过程中发现超限
+    response = web.StreamResponse()
+    response.content_type = "image/png"
+    await response.prepare(request)
+    try:
+        for _ in range(1024):
+            await response.write(b"\x00" * 65536)
+    except ConnectionError:
+        pass
+    return response
+
+
+async def _slow(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse()
+    response.content_type = "image/png"
+    await response.prepare(request)
+    try:
+        for _ in range(20):
+            await response.write(b"\x00")
+            await asyncio.sleep(0.5)
+    except ConnectionError:
+        pass
+    return response
+
+
+ROUTES = {
+    "/ok": _ok,
+    "/octet": _octet_stream,
+    "/gzip": _gzip,
+    "/html": _html,
+    "/404": _not_found,
+    "/huge-declared": _huge_declared,
+    "/huge-streamed": _huge_streamed,
+    "/slow": _slow,
+}
+
+
+def _download(plugin, local_server, path: str):
+    async def run():
+        async with local_server(ROUTES) as base:
+            result = await plugin.download_image(f"{base}{path}")
+        await plugin.terminate()
+        return result
+
+    return asyncio.run(run())
+
+
+def test_download_image(make_plugin, local_server):
+    assert _download(make_plugin(), local_server, "/ok") == PNG
+
+
+def test_download_generic_binary_type(make_plugin, local_server):
+    assert _download(make_plugin(), local_server, "/octet") == PNG
+
+
+def test_download_compressed_body(make_plugin, local_server):
+    assert _download(make_plugin(), local_server, "/gzip") == PNG * 64
+
+
+def test_download_rejects_wrong_content_type(make_plugin, local_server):
+    assert _download(make_plugin(), local_server, "/html") is None
+
+
+def test_download_rejects_error_status(make_plugin, local_server):
+    assert _download(make_plugin(), local_server, "/404") is None
+
+
+def test_download_rejects_declared_oversize(make_plugin, local_server):
+    plugin = make_plugin(download_max_size_mb=2)
+    assert _download(plugin, local_server, "/huge-declared") is None
+
+
+def test_download_aborts_streamed_oversize(make_plugin, local_server):
+    plugin = make_plugin(download_max_size_mb=2)
+    assert _download(plugin, local_server, "/huge-streamed") is None
+
+
+def test_download_without_size_limit(make_plugin, local_server):
+    plugin = make_plugin(download_max_size_mb=0)
+    assert len(_download(plugin, local_server, "/huge-declared")) == 3 * 1024 * 1024
+
+
+def test_download_times_out(make_plugin, local_server):
+    plugin = make_plugin(download_timeout=1)
+    assert _download(plugin, local_server, "/slow") is None
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+AVATAR = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+class FakeEvent:
+    """aiocqhttp 平台的最小消息事件"""
+
+    def __init__(self, messages):
+        self._messages = messages
+
+    def get_messages(self):
+        return self._messages
+
+    def get_message_str(self):
+        return " ".join(getattr(seg, "text", "") for seg in self._messages).strip()
+
+    def get_sender_id(self):
+        return "10001"
+
+    def get_self_id(self):
+        return "99999"
+
+    def get_sender_name(self):
+        return "发送者"
+
+    def get_group_id(self):
+        return "20001"
+
+    def get_platform_name(self):
+        return "aiocqhttp"
+
+
+def _fake_entry(plugin_module):
+    params = SimpleNamespace(
+        min_images=1, max_images=1, min_texts=0, max_texts=0, default_texts=[], args=[]
+    )
+    meme = SimpleNamespace(key="fake", info=SimpleNamespace(keywords=["假"], tags=[], params=params))
+    return plugin_module.MemeRegistry._build_entry(meme)
+
+
+@pytest.fixture
+def plugin(make_plugin, monkeypatch):
+    plugin = make_plugin(user_info_timeout=0.1, param_timeout=5)
+
+    async def get_avatar(event, user_id):
+        return AVATAR
+
+    monkeypatch.setattr(plugin, "get_avatar", get_avatar)
+    return plugin
+
+
+def _collect(plugin, plugin_module):
+    comp = plugin_module.Comp
+    event = FakeEvent([comp.Plain(text="假"), comp.At(qq="12345")])
+    return asyncio.run(plugin._get_parms(event, "假", _fake_entry(plugin_module)))
+
+
+def _assert_valid_options(options: dict):
+    # 生成器只接受 bool/str/int/float 类型的选项值
+    for name, value in options.items():
+        assert isinstance(value, (bool, str, int, float)), (name, value)
+
+
+def test_user_info_timeout_falls_back_to_unknown_gender(plugin, plugin_module, monkeypatch):
+    async def slow_user_info(event, target_id):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(plugin, "_fetch_user_info", slow_user_info)
+    meme_images, texts, options = _collect(plugin, plugin_module)
+
+    assert meme_images == [("发送者", AVATAR)]
+    assert options["name"] == "发送者"
+    assert options["gender"] == plugin_module.UNKNOWN_GENDER
+    _assert_valid_options(options)
+
+
+def test_user_info_error_falls_back_to_unknown_gender(plugin, plugin_module, monkeypatch):
+    async def failing_user_info(event, target_id):
+        raise RuntimeError("get_stranger_info failed")
+
+    monkeypatch.setattr(plugin, "_fetch_user_info", failing_user_info)
+    _, _, options = _collect(plugin, plugin_module)
+
+    assert options["gender"] == plugin_module.UNKNOWN_GENDER
+    _assert_valid_options(options)
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+
+def _brute_force_fuzzy(keywords: list[str], message: str) -> str | None:
+    """参照实现：包含在消息中的最长关键词，同长取最靠前的"""
+    best = None
+    best_key = None
+    for keyword in keywords:
+        start = message.find(keyword)
+        if keyword and start >= 0:
+            key = (-len(keyword), start)
+            if best_key is None or key < best_key:
+                best, best_key = keyword, key
+    return best
+
+
+@pytest.fixture
+def KeywordIndex(plugin_module):
+    return plugin_module.KeywordIndex
+
+
+def test_exact_match_uses_first_word(KeywordIndex):
+    index = KeywordIndex(["摸", "摸摸头", "petpet"])
+    assert index.match_exact("摸 @someone") == "摸"
+    assert index.match_exact("摸摸头") == "摸摸头"
+    assert index.match_exact("  petpet  text") == "petpet"
+    assert index.match_exact("摸鱼") is None
+    assert index.match_exact("") is None
+
+
+def test_contains_and_len(KeywordIndex):
+    index = KeywordIndex(["摸", "摸", "亲", ""])
+    assert len(index) == 2
+    assert "摸" in index
+    assert "" not in index
+
+
+def test_fuzzy_match_prefers_longest(KeywordIndex):
+    index = KeywordIndex(["摸", "摸摸头", "头"])
+    assert index.match_fuzzy("来摸摸头吧") == "摸摸头"
+    assert index.match_fuzzy("摸一下") == "摸"
+    assert index.match_fuzzy("没有关键词") is None
+
+
+def test_fuzzy_match_tie_goes_to_earliest(KeywordIndex):
+    index = KeywordIndex(["亲亲", "摸摸"])
+    assert index.match_fuzzy("摸摸和亲亲") == "摸摸"
+    assert index.match_fuzzy("亲亲和摸摸") == "亲亲"
+
+
+def test_fuzzy_match_overlapping_keywords(KeywordIndex):
+    # 失配链上的关键词：abcd 不完整时应退回到 bc
+    index = KeywordIndex(["abcd", "bc", "c"])
+    assert index.match_fuzzy("xabcx") == "bc"
+    assert index.match_fuzzy("abcd") == "abcd"
+
+
+def test_fuzzy_match_agrees_with_brute_force(KeywordIndex):
+    rng = random.Random(0)
+    alphabet = "摸头亲ab"
+    keywords = sorted({"".join(rng.choices(alphabet, k=rng.randint(1, 4))) for _ in range(40)})
+    index = KeywordIndex(keywords)
+    for _ in range(5000):
+        message = "".join(rng.choices(alphabet + " x", k=rng.randint(0, 20)))
+        assert index.match_fuzzy(message) == _brute_force_fuzzy(keywords, message), message
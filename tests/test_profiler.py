@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import tracemalloc
+from types import SimpleNamespace
+
+
+def test_memory_snapshots_are_taken_off_the_event_loop(plugin_module, tmp_path, monkeypatch):
+    take_snapshot = tracemalloc.take_snapshot
+    snapshot_threads = []
+
+    def recording_take_snapshot():
+        snapshot_threads.append(threading.current_thread())
+        return take_snapshot()
+
+    monkeypatch.setattr(tracemalloc, "take_snapshot", recording_take_snapshot)
+    profiler = plugin_module.RequestProfiler(
+        tmp_path, sample_rate=1, meme_keys=set(), threshold=0, max_reports=5
+    )
+    entry = SimpleNamespace(key="petpet", keywords=("摸",))
+
+    async def stage():
+        await asyncio.sleep(0)
+        return [bytes(1024) for _ in range(100)]
+
+    async def run():
+        session = profiler.begin(entry)
+        result = await session.measure("收集参数", stage())
+        loop_thread = threading.current_thread()
+        assert profiler.finish(session)
+        path = await asyncio.to_thread(profiler.write_report, session)
+        return session, result, loop_thread, path
+
+    session, result, loop_thread, path = asyncio.run(run())
+    assert len(result) == 100
+    assert len(snapshot_threads) == 2
+    assert loop_thread not in snapshot_threads
+    assert [stage for stage, *_ in session.memory] == ["收集参数"]
+    assert "tracemalloc：收集参数 内存变化" in path.read_text(encoding="utf-8")
+    assert not tracemalloc.is_tracing()
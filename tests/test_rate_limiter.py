@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def RateLimiter(plugin_module):
+    return plugin_module.RateLimiter
+
+
+def test_disabled_limiter_never_blocks(RateLimiter):
+    limiter = RateLimiter(per_minute=0, burst=1)
+    for _ in range(10):
+        limiter.consume("user")
+    assert limiter.has_token("user")
+    assert not limiter._buckets
+
+
+def test_burst_then_blocked(RateLimiter):
+    limiter = RateLimiter(per_minute=1, burst=2)
+    limiter.consume("user")
+    assert limiter.has_token("user")
+    limiter.consume("user")
+    assert not limiter.has_token("user")
+    assert limiter.has_token("other")
+
+
+def test_bucket_count_stays_bounded_when_all_active(RateLimiter):
+    # 刷新速度极慢，所有桶都不会补满，只能按最近使用淘汰
+    limiter = RateLimiter(per_minute=0.001, burst=1, max_keys=100)
+    for i in range(1000):
+        limiter.consume(f"user{i}")
+    assert len(limiter._buckets) <= 100
+    assert "user999" in limiter._buckets
+    assert "user0" not in limiter._buckets
+
+
+def test_recently_used_bucket_survives_eviction(RateLimiter):
+    limiter = RateLimiter(per_minute=0.001, burst=5, max_keys=3)
+    limiter.consume("a")
+    limiter.consume("b")
+    limiter.consume("c")
+    limiter.consume("a")
+    limiter.consume("d")
+    assert list(limiter._buckets) == ["c", "a", "d"]
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+
+def _blocking_meme(release: threading.Event):
+    def generate(images, texts, options):
+        release.wait(5)
+        return b"done"
+
+    return SimpleNamespace(key="slow", generate=generate)
+
+
+async def _render_in_slot(executor, meme, session_key: str):
+    with executor.slot(session_key) as slot:
+        return await executor.render(meme, [], [], {}, slot)
+
+
+def test_timed_out_render_keeps_slot_until_worker_finishes(plugin_module):
+    release = threading.Event()
+    meme = _blocking_meme(release)
+
+    async def run():
+        executor = plugin_module.RenderExecutor(workers=1, queue_size=0, per_session=1)
+        try:
+            with executor.slot("group") as slot:
+                await asyncio.wait_for(executor.render(meme, [], [], {}, slot), 0.1)
+        except asyncio.TimeoutError:
+            pass
+
+        # 调用方已放弃等待，但工作线程仍在渲染，名额不能提前归还
+        still_held = (executor.active, executor.can_admit("group"), executor.can_admit("other"))
+
+        release.set()
+        for _ in range(100):
+            if not executor.active:
+                break
+            await asyncio.sleep(0.02)
+        released = (executor.active, executor.can_admit("group"), executor._render_semaphore.locked())
+        executor.shutdown()
+        return still_held, released
+
+    still_held, released = asyncio.run(run())
+    assert still_held == (1, False, False)
+    assert released == (0, True, False)
+
+
+def test_render_cancelled_while_queued_releases_slot(plugin_module):
+    release = threading.Event()
+    meme = _blocking_meme(release)
+
+    async def run():
+        executor = plugin_module.RenderExecutor(workers=1, queue_size=1, per_session=0)
+        first = asyncio.ensure_future(_render_in_slot(executor, meme, "a"))
+        await asyncio.sleep(0.05)
+        try:
+            # 唯一的工作线程被占用，第二个任务在排队中超时
+            await asyncio.wait_for(_render_in_slot(executor, meme, "b"), 0.1)
+        except asyncio.TimeoutError:
+            pass
+        queued_released = executor._sessions.copy()
+        release.set()
+        result = await first
+        executor.shutdown()
+        return queued_released, result, executor.active
+
+    queued_released, result, active = asyncio.run(run())
+    assert queued_released == {"a": 1}
+    assert result == b"done"
+    assert active == 0
@@ -0,0 +1,72 @@
+import asyncio
+
+from aiohttp import web
+
+CONCURRENCY = 50
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024
+
+
+def _counting_handler(counter: list[int]):
+    async def handler(request: web.Request) -> web.Response:
+        counter.append(1)
+        # 保持请求进行中，确保并发调用在结果返回前全部到达
+        await asyncio.sleep(0.2)
+        return web.Response(body=PNG, content_type="image/png")
+
+    return handler
+
+
+def test_concurrent_download_image_fetches_once(make_plugin, local_server):
+    plugin = make_plugin()
+    hits: list[int] = []
+
+    async def run():
+        async with local_server({"/img": _counting_handler(hits)}) as base:
+            results = await asyncio.gather(
+                *[plugin.download_image(f"{base}/img") for _ in range(CONCURRENCY)]
+            )
+        await plugin.terminate()
+        return results
+
+    results = asyncio.run(run())
+    assert len(hits) == 1
+    assert all(result == PNG for result in results)
+
+
+class _RedirectSession:
+    """把所有请求转发到本地服务的会话包装"""
+
+    def __init__(self, session, url: str):
+        self._session = session
+        self._url = url
+
+    def get(self, _url, **kwargs):
+        return self._session.get(self._url, **kwargs)
+
+
+def test_concurrent_get_avatar_fetches_once(make_plugin, local_server, monkeypatch):
+    plugin = make_plugin()
+    hits: list[int] = []
+
+    async def run():
+        async with local_server({"/avatar": _counting_handler(hits)}) as base:
+            session = await plugin._get_session()
+            redirect = _RedirectSession(session, f"{base}/avatar")
+
+            async def _get_session():
+                return redirect
+
+            monkeypatch.setattr(plugin, "_get_session", _get_session)
+            results = await asyncio.gather(
+                *[plugin.get_avatar(None, "12345") for _ in range(CONCURRENCY)]
+            )
+            # 之后的调用直接命中缓存
+            cached = await plugin.get_avatar(None, "12345")
+            await session.close()
+        await plugin.terminate()
+        return results, cached
+
+    results, cached = asyncio.run(run())
+    assert len(hits) == 1
+    assert all(result == PNG for result in results)
+    assert cached == PNG